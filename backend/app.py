@@ -1,45 +1,111 @@
 import os
+import io
+import csv
+import json
+import math
 import time
 import secrets
-from flask import Flask, request, jsonify, send_from_directory
+import threading
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, send_from_directory
 from flask_cors import CORS
-import psycopg2
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from psycopg2.errors import RaiseException
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
 from redis_config import (
-    store_token, get_token, delete_token, store_session_data, get_session_data, delete_session_data,
-    cache_artworks, get_cached_artworks, invalidate_artworks_cache,
-    cache_artwork_reviews, get_cached_artwork_reviews, invalidate_artwork_reviews_cache,
-    publish_notification, redis_client
+    store_token, get_token, get_user_id_by_token, delete_token, store_session_data, get_session_data, delete_session_data,
+    get_session_role, set_session_role,
+    cache_artworks, get_cached_artworks, cache_artwork, update_cached_artwork_stock, uncache_artwork,
+    invalidate_artworks_cache, get_artworks_version, get_reviews_version,
+    acquire_lock, release_lock, wait_for_lock, is_locked,
+    cache_artwork_reviews, get_cached_artwork_reviews, prepend_artwork_review, invalidate_artwork_reviews_cache,
+    REVIEWS_CACHE_SIZE,
+    get_cached_search, cache_search, SEARCH_CACHE_MIN_HITS,
+    get_notification_lag, redis_client
+)
+from db_config import db_connection, get_pool, get_pool_stats, close_pool
+from rate_limiter import check_rate_limits, record_attempt
+from metrics import start_request, finish_request, count_cache, render_metrics
+from json_codec import dumps, loads, join_array
+from outbox import stage_notification, send_notification, start_outbox, flush_outbox, get_outbox_stats
+from bulk_import import import_artworks
+from images import (
+    derivative_urls, schedule_derivatives, resolve_derivative, delete_derivatives,
+    hashed_filename, is_hashed_filename
+)
+from reservations import (
+    OutOfStockError, reserve_stock, release_reservation, checkout_reservations,
+    get_reservation_stats, start_reservation_sweeper
 )
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)
 
 # Конфигурация для загрузки файлов
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-#
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# файлы с хэшем в имени не меняются - кэшируем на год
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', 3600))
+# '' - отдает Flask, 'x-sendfile' - Apache/lighttpd, 'x-accel' - nginx
+STATIC_OFFLOAD = os.getenv('STATIC_OFFLOAD', '')
+STATIC_ACCEL_PREFIX = os.getenv('STATIC_ACCEL_PREFIX', '/_protected_uploads/')
+# сколько прокси перед бэкендом добавляют X-Forwarded-For; 0 - заголовку не доверяем (клиент может его подделать)
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+
+def create_app():
+    app = Flask(__name__)
+    if TRUSTED_PROXIES:
+        # адрес клиента из X-Forwarded-For, который добавили доверенные прокси (фронтенд, nginx)
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+    CORS(app, expose_headers=['X-Next-Cursor', 'X-Next-Rating', 'X-Next-Date', 'X-Next-Offset', 'Retry-After', 'ETag'])
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['USE_X_SENDFILE'] = STATIC_OFFLOAD == 'x-sendfile'
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    app.register_blueprint(api)
+    app.before_request(start_request)
+    app.after_request(record_request_metrics)
+    return app
+
+def record_request_metrics(response):
+    # шаблон маршрута, а не путь - чтобы число серий не зависело от id
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    finish_request(route, request.method, str(response.status_code), size)
+    return response
+
+# сколько воркер ждет базу и Redis при старте; меньше GUNICORN_TIMEOUT
+WARM_UP_TIMEOUT = float(os.getenv('WARM_UP_TIMEOUT', 20))
+
+def warm_up():
+    # соединения открываем до того, как воркер начнет принимать запросы
+    deadline = time.monotonic() + WARM_UP_TIMEOUT
+    delay = 0.5
+    while True:
+        try:
+            get_pool().warm_up()
+            redis_client.ping()
+            break
+        except Exception as e:
+            # при первом запуске база еще применяет миграции: ждем с нарастающей паузой
+            if time.monotonic() + delay > deadline:
+                # воркер не падает, соединения откроются при первых запросах
+                print(f"Error warming up connections: {str(e)}")
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+    start_outbox()
+
+def shut_down():
+    flush_outbox()
+    close_pool()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_db_connection():
-    conn = psycopg2.connect(
-        dbname=os.getenv('POSTGRES_DB', 'artshop'),
-        user=os.getenv('POSTGRES_USER', 'postgres'),
-        password=os.getenv('POSTGRES_PASSWORD', '123'),
-        host=os.getenv('DB_HOST', 'db'),
-        port=os.getenv('DB_PORT', '5432')
-    )
-    return conn
-
-def get_user_role(user_id):
-    conn = get_db_connection()
+def _fetch_user_role(conn, user_id):
     cur = conn.cursor()
     cur.execute("""
         SELECT r.name FROM "user" u
@@ -48,11 +114,140 @@ def get_user_role(user_id):
     """, (user_id,))
     result = cur.fetchone()
     cur.close()
-    conn.close()
     if result:
         return result[0]
     return None
 
+# роли в памяти процесса; другие воркеры увидят смену роли не позже чем через ROLE_CACHE_TTL.
+# Поэтому локально держим только обычную роль: повышение может запоздать, а снятие прав - нет,
+# права admin/editor каждый раз сверяются с сессией в Redis
+ROLE_CACHE_TTL = float(os.getenv('ROLE_CACHE_TTL', 30))
+ROLE_CACHE_SIZE = 10000
+LOCALLY_CACHED_ROLES = ('regular_user',)
+_role_cache = {}
+_role_cache_lock = threading.Lock()
+
+def get_user_role(user_id, conn=None):
+    """Role from the in-process cache (regular users only), then the Redis session, then Postgres."""
+    user_id = str(user_id)
+    now = time.monotonic()
+    cached = _role_cache.get(user_id)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    role = get_session_role(user_id)
+    if role is None:
+        # если соединение уже взято из пула, используем его
+        if conn is not None:
+            role = _fetch_user_role(conn, user_id)
+        else:
+            with db_connection() as conn:
+                role = _fetch_user_role(conn, user_id)
+        if role is not None:
+            set_session_role(user_id, role)
+
+    if role in LOCALLY_CACHED_ROLES:
+        with _role_cache_lock:
+            if len(_role_cache) >= ROLE_CACHE_SIZE:
+                _role_cache.clear()
+            _role_cache[user_id] = (role, now + ROLE_CACHE_TTL)
+    return role
+
+def invalidate_user_role(user_id, role=None):
+    # после смены роли: новая роль сразу в сессии, локальная копия сбрасывается
+    with _role_cache_lock:
+        _role_cache.pop(str(user_id), None)
+    if role is not None:
+        set_session_role(user_id, role)
+
+def artwork_from_row(colnames, row):
+    art = dict(zip(colnames, row))
+    # Decimal кодирует json_codec; дату приводим к ISO сами, как в review_from_row
+    art['stock'] = art['stock'] if art['stock'] is not None else 0
+    if art.get('last_review_date') is not None:
+        art['last_review_date'] = art['last_review_date'].isoformat()
+    art['photo_urls'] = derivative_urls(art['photo_url'])
+    return art
+
+def fetch_artwork(conn, artwork_id):
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM get_artworks_proc() WHERE id = %s;", (artwork_id,))
+    row = cur.fetchone()
+    colnames = [desc[0] for desc in cur.description]
+    cur.close()
+    return artwork_from_row(colnames, row) if row else None
+
+def refresh_cached_stock(conn, artwork_ids):
+    # после изменения остатков обновляем только затронутые артикулы в кэше
+    if not artwork_ids:
+        return
+    cur = conn.cursor()
+    cur.execute("SELECT artwork_id, stock FROM inventory WHERE artwork_id = ANY(%s);", (list(artwork_ids),))
+    rows = cur.fetchall()
+    cur.close()
+    try:
+        for artwork_id, stock in rows:
+            update_cached_artwork_stock(artwork_id, stock)
+    except Exception as cache_error:
+        print(f"Cache error: {str(cache_error)}")
+
+def refresh_cached_stock_for(artwork_ids):
+    with db_connection() as conn:
+        refresh_cached_stock(conn, artwork_ids)
+
+REVIEWS_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def count_cache_lookup(cache, data, refresh):
+    if data is None:
+        count_cache(cache, 'miss')
+    else:
+        count_cache(cache, 'stale' if refresh else 'hit')
+
+def not_modified(etag, cache=None):
+    # у клиента уже эта версия - отвечаем 304 без базы и без чтения кэша
+    if etag and request.if_none_match.contains_weak(etag):
+        if cache:
+            count_cache(cache, 'not_modified')
+        response = Response(status=304)
+        set_etag(response, etag)
+        return response
+    return None
+
+def json_response(body):
+    # тело уже в JSON (из кэша или json_codec), jsonify не нужен
+    return Response(body, mimetype='application/json')
+
+def set_etag(response, etag):
+    if etag:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def get_page_args():
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    if offset < 0 or (limit is not None and limit <= 0):
+        raise ValueError('offset must be >= 0 and limit must be > 0')
+    return offset, limit
+
+def rate_limited(action, record=True, **identifiers):
+    retry_after = check_rate_limits(action, record, **identifiers)
+    if not retry_after:
+        return None
+    response = jsonify({'error': 'Too many requests, try again later'})
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response, 429
+
+def admin_required():
+    # служебные эндпоинты: user_id из query string, как в /admin/orders/export
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    if get_user_role(user_id) != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return None
+
 def generate_auth_token():
     """Generate a secure random token"""
     return secrets.token_hex(32)
@@ -61,18 +256,15 @@ def verify_token(token):
     """Verify if token exists in Redis and return user_id"""
     if not token:
         return None
-    
-    # Search for token in Redis
-    for key in redis_client.scan_iter("user_token:*"):
-        stored_token = redis_client.get(key)
-        if stored_token == token:
-            user_id = key.split(':')[1]
-            return user_id
-    return None
 
-@app.route('/register', methods=['POST'])
+    return get_user_id_by_token(token)
+
+@api.route('/register', methods=['POST'])
 def register():
-    time.sleep(1)
+    limited = rate_limited('register', ip=request.remote_addr)
+    if limited:
+        return limited
+
     data = request.get_json()
     username = data.get('username')
     email = data.get('email')
@@ -82,25 +274,26 @@ def register():
         return jsonify({'error': 'Username, email and password are required'}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with db_connection() as conn:
+            cur = conn.cursor()
 
-        # Проверка на существование данного email при регистрации
-        cur.execute('SELECT id FROM "user" WHERE username = %s OR email = %s', (username, email))
-        if cur.fetchone():
-            cur.close()
-            conn.close()
-            return jsonify({'error': 'Username or email already exists'}), 400
+            # Проверка на существование данного email при регистрации
+            cur.execute('SELECT id FROM "user" WHERE username = %s OR email = %s', (username, email))
+            if cur.fetchone():
+                cur.close()
+                return jsonify({'error': 'Username or email already exists'}), 400
 
-        password_hash = generate_password_hash(password)
+            password_hash = generate_password_hash(password)
+
+            # Вызов процедуры регистрации
+            cur.execute("CALL register_user_proc(%s, %s, %s);", (username, email, password_hash))
+            conn.commit()
 
-        # Вызов процедуры регистрации
-        cur.execute("CALL register_user_proc(%s, %s, %s);", (username, email, password_hash))
-        conn.commit()
+            # Узнать id нового пользователя
+            cur.execute('SELECT id FROM "user" WHERE username = %s;', (username,))
+            user_record = cur.fetchone()
+            cur.close()
 
-        # Узнать id нового пользователя
-        cur.execute('SELECT id FROM "user" WHERE username = %s;', (username,))
-        user_record = cur.fetchone()
         if user_record:
             user_id = user_record[0]
             # Generate and store token
@@ -110,15 +303,12 @@ def register():
             session_data = {
                 'username': username,
                 'email': email,
-                'role': 'user'  # Default role for new users
+                'role': 'regular_user'  # Default role for new users
             }
             store_session_data(user_id, session_data)
         else:
             user_id = None
 
-        cur.close()
-        conn.close()
-
         if user_id:
             return jsonify({
                 'message': 'User registered successfully',
@@ -130,39 +320,42 @@ def register():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
-    time.sleep(1)
     data = request.get_json()
     username = data.get('username')
     password = data.get('password')
 
+    # Защита от перебора паролей: лимит по IP и по логину, считаются только неудачные входы
+    limited = rate_limited('login', record=False, ip=request.remote_addr, username=username)
+    if limited:
+        return limited
+
     if not username or not password:
         return jsonify({'error': 'Username and password are required'}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Получение хеш пароля и user_id
-        cur.execute('SELECT id, password_hash FROM "user" WHERE username = %s;', (username,))
-        result = cur.fetchone()
-        if not result:
-            cur.close()
-            conn.close()
-            return jsonify({'error': 'Invalid credentials'}), 401
-
-        user_id, stored_hash = result
-        if not check_password_hash(stored_hash, password):
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            # Получение хеш пароля и user_id
+            cur.execute('SELECT id, password_hash FROM "user" WHERE username = %s;', (username,))
+            result = cur.fetchone()
+            if not result:
+                cur.close()
+                record_attempt('login', ip=request.remote_addr, username=username)
+                return jsonify({'error': 'Invalid credentials'}), 401
+
+            user_id, stored_hash = result
+            if not check_password_hash(stored_hash, password):
+                cur.close()
+                record_attempt('login', ip=request.remote_addr, username=username)
+                return jsonify({'error': 'Invalid credentials'}), 401
+
+            # Вызов функции для получения user_id и роли
+            cur.execute("SELECT * FROM login_user_proc(%s, %s);", (username, stored_hash))
+            login_result = cur.fetchone()
             cur.close()
-            conn.close()
-            return jsonify({'error': 'Invalid credentials'}), 401
-
-        # Вызов функции для получения user_id и роли
-        cur.execute("SELECT * FROM login_user_proc(%s, %s);", (username, stored_hash))
-        login_result = cur.fetchone()
-        cur.close()
-        conn.close()
 
         if login_result:
             fetched_user_id, role = login_result
@@ -188,7 +381,7 @@ def login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/logout', methods=['POST'])
+@api.route('/logout', methods=['POST'])
 def logout():
     token = request.headers.get('Authorization')
     if not token:
@@ -204,46 +397,207 @@ def logout():
     
     return jsonify({'message': 'Logged out successfully'}), 200
 
-@app.route('/artworks', methods=['GET'])
-def get_artworks():
+# замок пересборки живет дольше самой долгой пересборки
+REBUILD_LOCK_TTL = 120
+# сколько запрос ждет чужую пересборку, прежде чем идти в базу сам
+CACHE_STAMPEDE_WAIT = float(os.getenv('CACHE_STAMPEDE_WAIT', 0.2))
+# весь каталог без кэша - самый дорогой запрос, его ждем дольше (меньше GUNICORN_TIMEOUT)
+FULL_CATALOG_WAIT = float(os.getenv('FULL_CATALOG_WAIT', 10))
+
+# фоновые пересборки, запущенные этим процессом
+_background_rebuilds = set()
+_background_rebuilds_lock = threading.Lock()
+
+def start_background_rebuild(lock_name, target, *args):
+    # не плодим потоки: ни второго в этом процессе, ни одного, пока замок держит другой воркер
+    if is_locked(lock_name):
+        return
+    with _background_rebuilds_lock:
+        if lock_name in _background_rebuilds:
+            return
+        _background_rebuilds.add(lock_name)
+
+    def run():
+        try:
+            target(*args)
+        finally:
+            with _background_rebuilds_lock:
+                _background_rebuilds.discard(lock_name)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def rebuild_artworks_cache():
+    """Reload the whole catalog into the cache in one worker only. Returns the artworks, or None if another worker holds the lock."""
+    lock_token = acquire_lock('artworks:rebuild', ttl=REBUILD_LOCK_TTL)
+    if not lock_token:
+        return None
     try:
-        # Сначала пробуем взять кэш
+        start = time.perf_counter()
+        # версию читаем до базы, чтобы заметить записи, прошедшие во время пересборки
+        version = get_artworks_version()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM get_artworks_proc() ORDER BY id;")
+            rows = cur.fetchall()
+            colnames = [desc[0] for desc in cur.description]
+            cur.close()
+        artworks = [artwork_from_row(colnames, row) for row in rows]
         try:
-            cached_artworks = get_cached_artworks()
-            if cached_artworks:
-                return jsonify(cached_artworks), 200
+            cache_artworks(artworks, time.perf_counter() - start, version)
         except Exception as cache_error:
-            print(f"Cache error: {str(cache_error)}")
-            
+            print(f"Error rebuilding artworks cache: {str(cache_error)}")
+        return artworks
+    finally:
+        release_lock('artworks:rebuild', lock_token)
 
-        # Если нет кэша, то берем из базы
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM get_artworks_proc();")
-        rows = cur.fetchall()
-        colnames = [desc[0] for desc in cur.description]
-        cur.close()
-        conn.close()
+def start_artworks_rebuild():
+    start_background_rebuild('artworks:rebuild', rebuild_artworks_cache)
 
-        artworks = [dict(zip(colnames, row)) for row in rows]
-        # Преобразуем price из Decimal
-        for art in artworks:
-            art['price'] = float(art['price'])
-            art['stock'] = int(art['stock']) if art['stock'] is not None else 0
+def cached_artworks_after_rebuild(offset, limit, category, after_id, timeout):
+    # промах: если кэш уже пересобирает другой воркер, ждем его и читаем кэш еще раз
+    if not is_locked('artworks:rebuild') or not wait_for_lock('artworks:rebuild', timeout):
+        return None
+    cached_artworks, _ = get_cached_artworks(offset, limit, category, after_id)
+    return cached_artworks
+
+def artworks_page_response(artworks, limit, sort='id', etag=None, raw=False):
+    """raw=True: artworks are JSON strings from the cache and are sent without decoding."""
+    response = set_etag(json_response(join_array(artworks) if raw else dumps(artworks)), etag)
+    # курсор для следующей страницы; из кэша разбираем только последний элемент
+    if limit is not None and len(artworks) == limit:
+        last = loads(artworks[-1]) if raw else artworks[-1]
+        response.headers['X-Next-Cursor'] = str(last['id'])
+        if sort == 'rating':
+            response.headers['X-Next-Rating'] = str(last['rating_avg'])
+    return response, 200
+
+@api.route('/artworks', methods=['GET'])
+def get_artworks():
+    try:
+        offset, limit = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    after_id = request.args.get('after_id', type=int)
+    category = request.args.get('category')
+    min_price = request.args.get('min_price', type=float)
+    max_price = request.args.get('max_price', type=float)
+    in_stock = request.args.get('in_stock', '').lower() in ('1', 'true', 'yes')
+    sort = request.args.get('sort', 'id')
+    after_rating = request.args.get('after_rating', type=float)
+    if sort not in ('id', 'rating'):
+        return jsonify({'error': 'sort must be id or rating'}), 400
+    if sort == 'rating' and after_id is not None and after_rating is None:
+        return jsonify({'error': 'after_rating is required with sort=rating'}), 400
+    # кэш упорядочен только по id, остальное считает база
+    db_only = min_price is not None or max_price is not None or in_stock or sort != 'id'
+
+    # версию читаем до данных: при гонке клиент получит новые данные со старым ETag и просто перезапросит
+    version = get_artworks_version()
+    etag = f"artworks-{version}" if version else None
+    cached_response = not_modified(etag, 'artworks')
+    if cached_response:
+        return cached_response
 
-        # Пытаемся кэшировать результаты
-        try:
-            cache_artworks(artworks)
-        except Exception as cache_error:
-            print(f"Cache error: {str(cache_error)}")
-            
-        
-        return jsonify(artworks), 200
+    try:
+        # Сначала пробуем взять кэш (в нем есть только порядок по id и категории)
+        if not db_only:
+            try:
+                cached_artworks, refresh = get_cached_artworks(offset, limit, category, after_id)
+                count_cache_lookup('artworks', cached_artworks, refresh)
+                if cached_artworks is not None:
+                    # мягкий срок вышел: отдаем текущую копию, а кэш обновляем в фоне
+                    if refresh:
+                        start_artworks_rebuild()
+                    return artworks_page_response(cached_artworks, limit, etag=etag, raw=True)
+            except Exception as cache_error:
+                print(f"Cache error: {str(cache_error)}")
+
+        full_catalog = limit is None and not (offset or after_id or category or db_only)
+        if full_catalog:
+            # весь каталог читает из базы и кладет в кэш один воркер, остальные ждут его
+            artworks = rebuild_artworks_cache()
+            if artworks is not None:
+                return artworks_page_response(artworks, limit, etag=etag)
+            cached_artworks = cached_artworks_after_rebuild(offset, limit, category, after_id, FULL_CATALOG_WAIT)
+            if cached_artworks is not None:
+                return artworks_page_response(cached_artworks, limit, etag=etag, raw=True)
+        elif not db_only:
+            cached_artworks = cached_artworks_after_rebuild(offset, limit, category, after_id, CACHE_STAMPEDE_WAIT)
+            if cached_artworks is not None:
+                return artworks_page_response(cached_artworks, limit, etag=etag, raw=True)
+
+        # Если нет кэша, то берем из базы только нужную страницу
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM get_artworks_page_proc(%s, %s, %s, %s, %s, %s, %s, %s);", (
+                after_id,
+                None if limit is None else offset + limit,
+                category,
+                min_price,
+                max_price,
+                in_stock,
+                sort,
+                after_rating
+            ))
+            rows = cur.fetchall()
+            colnames = [desc[0] for desc in cur.description]
+            cur.close()
+
+        artworks = [artwork_from_row(colnames, row) for row in rows]
+
+        if not db_only:
+            # кэш прогреваем в фоне, чтобы ответ зависел только от размера страницы
+            start_artworks_rebuild()
+
+        return artworks_page_response(artworks[offset:], limit, sort, etag)
     except Exception as e:
         print(f"Error in get_artworks: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/create_order', methods=['POST'])
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_OFFSET = 1000
+SEARCH_MAX_QUERY_LENGTH = 200
+# сколько совпадений (полнотекстовых и по триграммам) берется из индекса и ранжируется на запрос
+SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 1000))
+
+@api.route('/search', methods=['GET'])
+def search_artworks():
+    # регистр и лишние пробелы не влияют на результат и на ключ кэша
+    query = ' '.join((request.args.get('q') or '').lower().split())
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    offset = request.args.get('offset', 0, type=int)
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    if len(query) > SEARCH_MAX_QUERY_LENGTH:
+        return jsonify({'error': 'q is too long'}), 400
+    if offset < 0 or offset > SEARCH_MAX_OFFSET:
+        return jsonify({'error': f'offset must be between 0 and {SEARCH_MAX_OFFSET}'}), 400
+
+    try:
+        results, hits = get_cached_search(query, limit, offset)
+        count_cache_lookup('search', results, False)
+        if results is None:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT * FROM search_artworks_proc(%s, %s, %s, %s);", (query, limit, offset, SEARCH_CANDIDATES))
+                rows = cur.fetchall()
+                colnames = [desc[0] for desc in cur.description]
+                cur.close()
+            body, count = dumps([artwork_from_row(colnames, row) for row in rows]), len(rows)
+            if hits >= SEARCH_CACHE_MIN_HITS:
+                cache_search(query, limit, offset, body, count)
+        else:
+            body, count = results
+
+        response = json_response(body)
+        if count == limit and offset + limit <= SEARCH_MAX_OFFSET:
+            response.headers['X-Next-Offset'] = str(offset + limit)
+        return response, 200
+    except Exception as e:
+        print(f"Error in search_artworks: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/create_order', methods=['POST'])
 def create_order():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -252,50 +606,126 @@ def create_order():
     if not user_id or not items or not isinstance(items, list):
         return jsonify({'error': 'Invalid request data'}), 400
 
+    # Собираем корзину в два массива для одного вызова процедуры
+    artwork_ids = []
+    quantities = []
+    for item in items:
+        artwork_id = item.get('artwork_id')
+        quantity = item.get('quantity', 1)
+        if not isinstance(artwork_id, int) or not isinstance(quantity, int) or quantity <= 0:
+            continue
+        artwork_ids.append(artwork_id)
+        quantities.append(quantity)
+
+    if not artwork_ids:
+        return jsonify({'error': 'Invalid request data'}), 400
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            # Весь заказ - одна транзакция и один вызов
+            cur.execute("CALL create_order_items_proc(%s, %s, %s, NULL);", (user_id, artwork_ids, quantities))
+            order_id = cur.fetchone()[0]
+            notification = {
+                'type': 'new_order',
+                'order_id': order_id,
+                'user_id': user_id,
+                'items': [
+                    {'artwork_id': artwork_id, 'quantity': quantity}
+                    for artwork_id, quantity in zip(artwork_ids, quantities)
+                ]
+            }
+            staged = stage_notification(cur, 'orders', notification)
+            conn.commit()
+            cur.close()
+            refresh_cached_stock(conn, set(artwork_ids))
 
-        order_ids = []
-        for item in items:
-            artwork_id = item.get('artwork_id')
-            quantity = item.get('quantity', 1)
-            if not artwork_id or not isinstance(quantity, int):
-                continue
+        # Уведомление о новом заказе уходит в фоне
+        send_notification('orders', notification, staged)
 
-            cur.execute("CALL create_order_proc(%s, %s, %s, %s);", (user_id, artwork_id, quantity, None))
-            conn.commit()
+        return jsonify({'message': 'Order created successfully', 'order_id': order_id, 'order_ids': [order_id]}), 201
+    except RaiseException as e:
+        # Недостаточно товара или неизвестное произведение
+        return jsonify({'error': e.diag.message_primary}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-            # Получение последнего созданного заказ для данного пользователя
-            cur.execute("""
-                SELECT id FROM "order"
-                WHERE user_id = %s
-                ORDER BY order_date DESC
-                LIMIT 1;
-            """, (user_id,))
-            order_record = cur.fetchone()
-            if order_record:
-                order_id = order_record[0]
-                order_ids.append(order_id)
-
-                # Отправляем уведомление о новом заказе PubSub
-                notification = {
-                    'type': 'new_order',
-                    'order_id': order_id,
-                    'user_id': user_id,
-                    'artwork_id': artwork_id,
-                    'quantity': quantity
-                }
-                publish_notification('orders', notification)
+@api.route('/reservations', methods=['POST'])
+def create_reservation():
+    data = request.get_json()
+    user_id = data.get('user_id')
+    artwork_id = data.get('artwork_id')
+    quantity = data.get('quantity', 1)
 
-        cur.close()
-        conn.close()
+    if not user_id or not isinstance(artwork_id, int) or not isinstance(quantity, int) or quantity <= 0:
+        return jsonify({'error': 'Invalid request data'}), 400
 
-        return jsonify({'message': 'Orders created successfully', 'order_ids': order_ids}), 201
+    try:
+        reservation_id, stock = reserve_stock(user_id, artwork_id, quantity)
+        try:
+            update_cached_artwork_stock(artwork_id, stock)
+        except Exception as cache_error:
+            print(f"Cache error: {str(cache_error)}")
+        return jsonify({'message': 'Stock reserved', 'reservation_id': reservation_id, 'stock': stock}), 201
+    except OutOfStockError as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/add_review', methods=['POST'])
+@api.route('/reservations/<int:reservation_id>', methods=['DELETE'])
+def delete_reservation(reservation_id):
+    data = request.get_json()
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    try:
+        artwork_id = release_reservation(reservation_id, user_id)
+        if artwork_id is None:
+            return jsonify({'error': 'Reservation not found'}), 404
+        refresh_cached_stock_for({artwork_id})
+        return jsonify({'message': 'Reservation released'}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/reservations/checkout', methods=['POST'])
+def checkout_reserved():
+    data = request.get_json()
+    user_id = data.get('user_id')
+    reservation_ids = data.get('reservation_ids')
+
+    if not user_id or not reservation_ids or not isinstance(reservation_ids, list):
+        return jsonify({'error': 'Invalid request data'}), 400
+
+    try:
+        order_id = checkout_reservations(user_id, reservation_ids)
+
+        # Уведомление о новом заказе уходит в фоне
+        notification = {
+            'type': 'new_order',
+            'order_id': order_id,
+            'user_id': user_id,
+            'reservation_ids': reservation_ids
+        }
+        send_notification('orders', notification)
+
+        return jsonify({'message': 'Order created successfully', 'order_id': order_id, 'order_ids': [order_id]}), 201
+    except OutOfStockError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/admin/reservations/stats', methods=['GET'])
+def reservation_stats():
+    try:
+        denied = admin_required()
+        if denied:
+            return denied
+        return jsonify(get_reservation_stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/add_review', methods=['POST'])
 def add_review():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -307,37 +737,53 @@ def add_review():
         return jsonify({'error': 'Missing required fields'}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO review (user_id, artwork_id, rating, comment)
-            VALUES (%s, %s, %s, %s)
-            RETURNING id;
-        """, (user_id, artwork_id, rating, comment))
-        review_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                WITH new_review AS (
+                    INSERT INTO reviews (user_id, artwork_id, rating, comment)
+                    VALUES (%s, %s, %s, %s)
+                    RETURNING *
+                )
+                SELECT new_review.*, u.username
+                FROM new_review
+                JOIN "user" u ON new_review.user_id = u.id;
+            """, (user_id, artwork_id, rating, comment))
+            review = review_from_row([desc[0] for desc in cur.description], cur.fetchone())
+            review_id = review['id']
+            notification = {
+                'type': 'new_review',
+                'artwork_id': artwork_id,
+                'user_id': user_id,
+                'rating': rating
+            }
+            staged = stage_notification(cur, 'artwork_reviews', notification)
+            conn.commit()
+            cur.close()
+            # триггер пересчитал рейтинг, обновляем артикул в кэше
+            artwork = fetch_artwork(conn, artwork_id)
 
-        # Удаляем кэш для этого артикула
-        invalidate_artwork_reviews_cache(artwork_id)
+        if artwork:
+            try:
+                cache_artwork(artwork)
+            except Exception as cache_error:
+                print(f"Cache error: {str(cache_error)}")
 
-        # Отправляем уведомление о новом отзыве PubSub
-        notification = {
-            'type': 'new_review',
-            'artwork_id': artwork_id,
-            'user_id': user_id,
-            'rating': rating
-        }
-        publish_notification('artwork_reviews', notification)
+        # Добавляем отзыв в начало закэшированного списка
+        try:
+            prepend_artwork_review(artwork_id, review)
+        except Exception as cache_error:
+            print(f"Cache error: {str(cache_error)}")
+
+        # Уведомление о новом отзыве уходит в фоне
+        send_notification('artwork_reviews', notification, staged)
 
         return jsonify({'message': 'Review added successfully', 'review_id': review_id}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/add_artwork', methods=['POST'])
+@api.route('/add_artwork', methods=['POST'])
 def add_artwork():
-    time.sleep(1)
     user_id = request.form.get('user_id')
     title = request.form.get('title')
     description = request.form.get('description', '')
@@ -349,70 +795,131 @@ def add_artwork():
     if not user_id or not title or not price or not category:
         return jsonify({'error': 'user_id, title, price and category are required'}), 400
 
-    try:
-        role = get_user_role(user_id)
-        if role != 'admin':
-            return jsonify({'error': 'Unauthorized'}), 403
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Получение category_id
-        cur.execute('SELECT id FROM category WHERE name = %s;', (category,))
-        category_result = cur.fetchone()
-        if not category_result:
-            cur.close()
-            conn.close()
-            return jsonify({'error': f'Category {category} does not exist'}), 400
-        category_id = category_result[0]
-
-        photo_url = None
-        if photo and allowed_file(photo.filename):
-            filename = secure_filename(photo.filename)
-            unique_filename = f"{int(time.time())}_{filename}"
-            photo_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            photo.save(photo_path)
-            photo_url = f"/static/uploads/{unique_filename}"
-
-        # Вызов процедуры для добавления артворка
-        cur.execute("""
-            CALL add_artwork_proc(%s, %s, %s, %s, %s, %s);
-        """, (title, description, price, category_id, photo_url, stock))
-        conn.commit()
-
-        # Получение ID добавленного артикула
-        cur.execute('SELECT id FROM artwork WHERE title = %s;', (title,))
-        artwork_record = cur.fetchone()
-        if artwork_record:
-            artwork_id = artwork_record[0]
-        else:
-            artwork_id = None
+    limited = rate_limited('add_artwork', user=user_id)
+    if limited:
+        return limited
 
-        cur.close()
-        conn.close()
+    try:
+        with db_connection() as conn:
+            role = get_user_role(user_id, conn)
+            if role != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+
+            cur = conn.cursor()
+
+            # Получение category_id
+            cur.execute('SELECT id FROM category WHERE name = %s;', (category,))
+            category_result = cur.fetchone()
+            if not category_result:
+                cur.close()
+                return jsonify({'error': f'Category {category} does not exist'}), 400
+            category_id = category_result[0]
+
+            photo_url = None
+            if photo and allowed_file(photo.filename):
+                filename = secure_filename(photo.filename)
+                unique_filename = hashed_filename(photo.stream, filename)
+                photo_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+                photo.save(photo_path)
+                photo_url = f"/static/uploads/{unique_filename}"
+                # превью и средний размер считаются в фоне
+                schedule_derivatives(current_app.config['UPLOAD_FOLDER'], unique_filename)
+
+            # Вызов процедуры для добавления артворка
+            cur.execute("""
+                CALL add_artwork_proc(%s, %s, %s, %s, %s, %s);
+            """, (title, description, price, category_id, photo_url, stock))
 
-        if artwork_id:
-            # Удаляем кэш для всех артикулов
-            invalidate_artworks_cache()
+            # Получение ID добавленного артикула
+            cur.execute('SELECT id FROM artwork WHERE title = %s;', (title,))
+            artwork_record = cur.fetchone()
+            if artwork_record:
+                artwork_id = artwork_record[0]
+            else:
+                artwork_id = None
 
-            # Отправляем уведомление о новом артикуле PubSub
             notification = {
                 'type': 'new_artwork',
                 'artwork_id': artwork_id,
                 'title': title,
                 'price': price
             }
-            publish_notification('artworks', notification)
+            staged = stage_notification(cur, 'artworks', notification) if artwork_id else False
+            conn.commit()
+            cur.close()
+            artwork = fetch_artwork(conn, artwork_id) if artwork_id else None
+
+        if artwork_id:
+            # Обновляем в кэше только этот артикул
+            if artwork:
+                try:
+                    cache_artwork(artwork)
+                except Exception as cache_error:
+                    print(f"Cache error: {str(cache_error)}")
 
-            return jsonify({'message': 'Artwork added successfully', 'artwork_id': artwork_id, 'photo_url': photo_url}), 201
+            # Уведомление о новом артикуле уходит в фоне
+            send_notification('artworks', notification, staged)
+
+            return jsonify({
+                'message': 'Artwork added successfully',
+                'artwork_id': artwork_id,
+                'photo_url': photo_url,
+                'photo_urls': derivative_urls(photo_url)
+            }), 201
         else:
             return jsonify({'error': 'Failed to add artwork'}), 500
 
     except Exception as e:
-        conn.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/delete_artwork', methods=['DELETE'])
+@api.route('/admin/artworks/import', methods=['POST'])
+def bulk_import_artworks():
+    user_id = request.form.get('user_id')
+    upload = request.files.get('file')
+    images = request.files.get('images')
+
+    if not user_id or not upload:
+        return jsonify({'error': 'user_id and file are required'}), 400
+    import_format = request.form.get('format') or ('csv' if upload.filename.lower().endswith('.csv') else 'ndjson')
+    if import_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    try:
+        with db_connection() as conn:
+            role = get_user_role(user_id, conn)
+            if role != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+
+            report = import_artworks(
+                conn,
+                upload.stream,
+                import_format,
+                archive=images.stream if images else None,
+                upload_folder=current_app.config['UPLOAD_FOLDER']
+            )
+            notification = {
+                'type': 'artworks_imported',
+                'inserted': report['inserted'],
+                'updated': report['updated']
+            }
+            cur = conn.cursor()
+            staged = stage_notification(cur, 'artworks', notification)
+            cur.close()
+            conn.commit()
+
+        # Кэш каталога сбрасываем один раз на весь импорт
+        try:
+            invalidate_artworks_cache()
+        except Exception as cache_error:
+            print(f"Cache error: {str(cache_error)}")
+
+        send_notification('artworks', notification, staged)
+
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/delete_artwork', methods=['DELETE'])
 def delete_artwork():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -422,40 +929,82 @@ def delete_artwork():
         return jsonify({'error': 'user_id and artwork_id are required'}), 400
 
     try:
-        role = get_user_role(user_id)
-        if role != 'admin':
-            return jsonify({'error': 'Unauthorized'}), 403
-
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Узнать photo_url для удаления файла
-        cur.execute('SELECT photo_url FROM artwork WHERE id = %s;', (artwork_id,))
-        photo_result = cur.fetchone()
-        photo_url = photo_result[0] if photo_result else None
+        with db_connection() as conn:
+            role = get_user_role(user_id, conn)
+            if role != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+
+            cur = conn.cursor()
+
+            # Узнать photo_url для удаления файла
+            cur.execute('SELECT photo_url FROM artwork WHERE id = %s;', (artwork_id,))
+            photo_result = cur.fetchone()
+            photo_url = photo_result[0] if photo_result else None
+
+            # Вызов процедуры для удаления артворка
+            cur.execute("CALL delete_artwork_proc(%s);", (artwork_id,))
+
+            # одинаковые изображения хранятся одним файлом: удаляем его, только если он больше ничей
+            if photo_url:
+                cur.execute("SELECT EXISTS (SELECT 1 FROM artwork WHERE photo_url = %s);", (photo_url,))
+                if cur.fetchone()[0]:
+                    photo_url = None
+            conn.commit()
+            cur.close()
 
-        # Вызов процедуры для удаления артворка
-        cur.execute("CALL delete_artwork_proc(%s);", (artwork_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            uncache_artwork(artwork_id)
+            invalidate_artwork_reviews_cache(artwork_id)
+        except Exception as cache_error:
+            print(f"Cache error: {str(cache_error)}")
 
         # Удаляем файл изображения
         if photo_url:
             photo_path = os.path.join(os.getcwd(), photo_url.lstrip('/'))
             if os.path.exists(photo_path):
                 os.remove(photo_path)
+            delete_derivatives(current_app.config['UPLOAD_FOLDER'], os.path.basename(photo_path))
 
         return jsonify({'message': 'Artwork deleted successfully'}), 200
     except Exception as e:
-        conn.rollback()
         return jsonify({'error': str(e)}), 500
 
-# @app.route('/update_artwork', methods=['PUT'])
+# @api.route('/update_artwork', methods=['PUT'])
 # def update_artwork():
 
 
-@app.route('/get_user_role', methods=['GET'])
+@api.route('/admin/users/<int:target_id>/role', methods=['PUT'])
+def set_user_role(target_id):
+    data = request.get_json()
+    user_id = data.get('user_id')
+    role = data.get('role')
+    if not user_id or not role:
+        return jsonify({'error': 'user_id and role are required'}), 400
+
+    try:
+        with db_connection() as conn:
+            if get_user_role(user_id, conn) != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM role WHERE name = %s;", (role,))
+            role_row = cur.fetchone()
+            if not role_row:
+                cur.close()
+                return jsonify({'error': 'Unknown role'}), 400
+            cur.execute('UPDATE "user" SET role_id = %s WHERE id = %s;', (role_row[0], target_id))
+            updated = cur.rowcount
+            conn.commit()
+            cur.close()
+
+        if not updated:
+            return jsonify({'error': 'User not found'}), 404
+        invalidate_user_role(target_id, role)
+        return jsonify({'message': 'Role updated', 'user_id': target_id, 'role': role}), 200
+    except Exception as e:
+        print(f"Error in set_user_role: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/get_user_role', methods=['GET'])
 def get_role():
     user_id = request.args.get('user_id')
     if not user_id:
@@ -469,136 +1018,332 @@ def get_role():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Маршрут для обслуживания статических файлов (изображений)   artwoork_id___filename
-@app.route('/static/uploads/<filename>')
-def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+@api.route('/admin/db_pool', methods=['GET'])
+def db_pool_stats():
+    try:
+        denied = admin_required()
+        if denied:
+            return denied
+        return jsonify(get_pool_stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/reviews/<int:artwork_id>', methods=['GET'])
-def get_reviews(artwork_id):
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@api.route('/admin/outbox', methods=['GET'])
+def outbox_stats():
     try:
-        # сначала пробуем взять кэш
-        cached_reviews = get_cached_artwork_reviews(artwork_id)
-        if cached_reviews:
-            return jsonify(cached_reviews), 200
+        denied = admin_required()
+        if denied:
+            return denied
+        return jsonify(get_outbox_stats()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/admin/notifications/lag', methods=['GET'])
+def notification_lag():
+    try:
+        denied = admin_required()
+        if denied:
+            return denied
+        return jsonify(get_notification_lag()), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        conn = get_db_connection()
+# Маршрут для обслуживания статических файлов (изображений)   artwoork_id___filename
+@api.route('/static/uploads/<filename>')
+def uploaded_file(filename):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    path = filename
+    immutable = is_hashed_filename(filename)
+    size = request.args.get('size')
+    if size:
+        derived = resolve_derivative(upload_folder, filename, size)
+        if derived:
+            path = derived
+        else:
+            # производная еще не готова - отдаем оригинал, но ненадолго
+            immutable = False
+    return send_upload(upload_folder, path, immutable)
+
+def send_upload(upload_folder, path, immutable):
+    max_age = IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE
+    if STATIC_OFFLOAD == 'x-accel':
+        # байты отдает nginx из internal location, ETag и Range тоже на нем
+        full_path = safe_join(upload_folder, path)
+        if full_path is None or not os.path.isfile(full_path):
+            return jsonify({'error': 'File not found'}), 404
+        response = Response(status=200)
+        response.headers['X-Accel-Redirect'] = f"{STATIC_ACCEL_PREFIX}{path}"
+        # тип файла определит nginx
+        del response.headers['Content-Type']
+    else:
+        # send_file сам ставит ETag/Last-Modified, отвечает 304 и поддерживает Range
+        response = send_from_directory(upload_folder, path, max_age=max_age, conditional=True, etag=True)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}" + (", immutable" if immutable else "")
+    return response
+
+def review_from_row(colnames, row):
+    review = dict(zip(colnames, row))
+    # ISO-формат сортируется как строка, на нем держится курсор
+    review['review_date'] = review['review_date'].isoformat(timespec='microseconds')
+    return review
+
+def reviews_page_response(reviews, limit, etag=None, raw=False):
+    """raw=True: reviews are JSON strings from the cache and are sent without decoding."""
+    response = set_etag(json_response(join_array(reviews) if raw else dumps(reviews)), etag)
+    if len(reviews) == limit:
+        last = loads(reviews[-1]) if raw else reviews[-1]
+        response.headers['X-Next-Cursor'] = str(last['id'])
+        response.headers['X-Next-Date'] = last['review_date']
+    return response, 200
+
+def load_reviews_head(artwork_id, limit):
+    # первая страница отзывов, из нее же заполняется кэш
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT r.*, u.username 
-            FROM review r
+            SELECT r.*, u.username
+            FROM reviews r
             JOIN "user" u ON r.user_id = u.id
             WHERE r.artwork_id = %s
-            ORDER BY r.review_date DESC;
-        """, (artwork_id,))
+            ORDER BY r.review_date DESC, r.id DESC
+            LIMIT %s;
+        """, (artwork_id, limit))
         rows = cur.fetchall()
         colnames = [desc[0] for desc in cur.description]
         cur.close()
-        conn.close()
-
-        reviews = [dict(zip(colnames, row)) for row in rows]
-        
-        # кэшируем результаты
-        cache_artwork_reviews(artwork_id, reviews)
-        
-        return jsonify(reviews), 200
+    return [review_from_row(colnames, row) for row in rows]
+
+def refresh_reviews_cache(artwork_id):
+    """Reload and cache the newest reviews in one worker only. Returns them, or None if another worker holds the lock."""
+    lock_name = f"reviews:{artwork_id}"
+    lock_token = acquire_lock(lock_name, ttl=REBUILD_LOCK_TTL)
+    if not lock_token:
+        return None
+    try:
+        start = time.perf_counter()
+        # версию читаем до базы: если за это время добавят отзыв, устаревший список не запишется
+        version = get_reviews_version(artwork_id)
+        # на один больше размера кэша - так видно, поместились ли все отзывы
+        reviews = load_reviews_head(artwork_id, REVIEWS_CACHE_SIZE + 1)
+        try:
+            cache_artwork_reviews(
+                artwork_id, reviews, len(reviews) <= REVIEWS_CACHE_SIZE, time.perf_counter() - start, version
+            )
+        except Exception as cache_error:
+            print(f"Cache error: {str(cache_error)}")
+        return reviews
+    finally:
+        release_lock(lock_name, lock_token)
+
+@api.route('/reviews/<int:artwork_id>', methods=['GET'])
+def get_reviews(artwork_id):
+    limit = min(max(request.args.get('limit', REVIEWS_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after_date = request.args.get('after_date')
+    after_id = request.args.get('after_id', type=int)
+    after = (after_date, after_id) if after_date and after_id is not None else None
+
+    version = get_reviews_version(artwork_id)
+    etag = f"reviews-{artwork_id}-{version}" if version else None
+    cached_response = not_modified(etag, 'reviews')
+    if cached_response:
+        return cached_response
+
+    try:
+        # сначала пробуем взять кэш
+        cached_reviews, refresh = get_cached_artwork_reviews(artwork_id, limit, after)
+        count_cache_lookup('reviews', cached_reviews, refresh)
+        if cached_reviews is not None:
+            if refresh:
+                start_background_rebuild(f"reviews:{artwork_id}", refresh_reviews_cache, artwork_id)
+            return reviews_page_response(cached_reviews, limit, etag, raw=True)
+
+        if after is None and limit > REVIEWS_CACHE_SIZE:
+            # страница больше кэша: читаем из базы, кэш не трогаем, иначе каждый такой запрос менял бы ETag
+            return reviews_page_response(load_reviews_head(artwork_id, limit), limit, etag)
+
+        if after is None:
+            # первую страницу из базы берет и кладет в кэш только один воркер
+            reviews = refresh_reviews_cache(artwork_id)
+            if reviews is None and wait_for_lock(f"reviews:{artwork_id}", CACHE_STAMPEDE_WAIT):
+                cached_reviews, _ = get_cached_artwork_reviews(artwork_id, limit)
+                if cached_reviews is not None:
+                    return reviews_page_response(cached_reviews, limit, etag, raw=True)
+            if reviews is None:
+                reviews = load_reviews_head(artwork_id, limit)
+            return reviews_page_response(reviews[:limit], limit, etag)
+
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT r.*, u.username
+                FROM reviews r
+                JOIN "user" u ON r.user_id = u.id
+                WHERE r.artwork_id = %s
+                  AND (r.review_date, r.id) < (%s::timestamp, %s)
+                ORDER BY r.review_date DESC, r.id DESC
+                LIMIT %s;
+            """, (artwork_id, after_date, after_id, limit))
+            rows = cur.fetchall()
+            colnames = [desc[0] for desc in cur.description]
+            cur.close()
+
+        reviews = [review_from_row(colnames, row) for row in rows]
+        return reviews_page_response(reviews[:limit], limit, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/orders/<int:user_id>', methods=['GET'])
-def get_orders(user_id):
-    try:
-        conn = get_db_connection()
+ORDERS_PAGE_SIZE = 20
+
+def fetch_orders_page(user_id=None):
+    """One page of orders grouped in SQL; filters and cursor come from the query string."""
+    limit = min(max(request.args.get('limit', ORDERS_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    after_date = request.args.get('after_date')
+    after_id = request.args.get('after_id', type=int)
+
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append('o.user_id = %s')
+        params.append(user_id)
+    if request.args.get('status'):
+        conditions.append('o.status = %s')
+        params.append(request.args['status'])
+    if request.args.get('date_from'):
+        conditions.append('o.order_date >= %s::timestamp')
+        params.append(request.args['date_from'])
+    if request.args.get('date_to'):
+        conditions.append('o.order_date < %s::timestamp')
+        params.append(request.args['date_to'])
+    if after_date and after_id is not None:
+        conditions.append('(o.order_date, o.id) < (%s::timestamp, %s)')
+        params.extend([after_date, after_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    params.append(limit)
+
+    with db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT o.id, o.order_date, o.status, oi.artwork_id, a.title, oi.quantity, oi.price
-            FROM "order" o
-            JOIN orderitem oi ON o.id = oi.order_id
-            JOIN artwork a ON oi.artwork_id = a.id
-            WHERE o.user_id = %s
-            ORDER BY o.order_date DESC;
-        """, (user_id,))
-        orders = cur.fetchall()
+        # сначала страница заказов по индексу, потом позиции только для нее
+        cur.execute(f"""
+            WITH page AS (
+                SELECT o.id, o.user_id, o.order_date, o.status
+                FROM "order" o
+                {where}
+                ORDER BY o.order_date DESC, o.id DESC
+                LIMIT %s
+            )
+            SELECT
+                page.id AS order_id,
+                to_char(page.order_date, 'YYYY-MM-DD HH24:MI:SS') AS order_date,
+                page.status,
+                u.username,
+                COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'artwork_id', oi.artwork_id,
+                        'title', a.title,
+                        'quantity', oi.quantity,
+                        'price', oi.price::float8
+                    ) ORDER BY oi.id)
+                    FROM orderitem oi
+                    JOIN artwork a ON oi.artwork_id = a.id
+                    WHERE oi.order_id = page.id
+                ), '[]'::json) AS items,
+                page.order_date AS cursor_date
+            FROM page
+            JOIN "user" u ON page.user_id = u.id
+            ORDER BY page.order_date DESC, page.id DESC;
+        """, params)
+        rows = cur.fetchall()
         cur.close()
-        conn.close()
-
-        orders_dict = {}
-        for order in orders:
-            order_id = order[0]
-            if order_id not in orders_dict:
-                orders_dict[order_id] = {
-                    'order_date': order[1].strftime('%Y-%m-%d %H:%M:%S'),
-                    'status': order[2],
-                    'items': []
-                }
-            orders_dict[order_id]['items'].append({
-                'artwork_id': order[3],
-                'title': order[4],
-                'quantity': order[5],
-                'price': float(order[6])
-            })
-
-        orders_list = []
-        for order_id, details in orders_dict.items():
-            orders_list.append({
-                'order_id': order_id,
-                'order_date': details['order_date'],
-                'status': details['status'],
-                'items': details['items']
-            })
 
-        return jsonify(orders_list), 200
+    orders = [
+        {'order_id': order_id, 'order_date': order_date, 'status': status, 'username': username, 'items': items}
+        for order_id, order_date, status, username, items, _ in rows
+    ]
+    response = jsonify(orders)
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = str(rows[-1][0])
+        response.headers['X-Next-Date'] = rows[-1][5].isoformat(timespec='microseconds')
+    return response
+
+@api.route('/orders/<int:user_id>', methods=['GET'])
+def get_orders(user_id):
+    try:
+        return fetch_orders_page(user_id), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/admin/orders', methods=['GET'])
+@api.route('/admin/orders', methods=['GET'])
 def get_all_orders():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        return fetch_orders_page(), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+EXPORT_ITERSIZE = int(os.getenv('EXPORT_ITERSIZE', 2000))
+EXPORT_COLUMNS = ['order_id', 'order_date', 'status', 'username', 'artwork_id', 'title', 'quantity', 'price']
+
+def stream_orders_export(export_format):
+    # соединение держим, пока клиент читает поток; вернется в пул в finally генератора
+    with db_connection() as conn:
+        cur = conn.cursor(name='orders_export')
+        cur.itersize = EXPORT_ITERSIZE
         cur.execute("""
-            SELECT o.id, o.order_date, o.status, u.username, oi.artwork_id, a.title, oi.quantity, oi.price
+            SELECT o.id, to_char(o.order_date, 'YYYY-MM-DD HH24:MI:SS'), o.status, u.username,
+                   oi.artwork_id, a.title, oi.quantity, oi.price::float8
             FROM "order" o
             JOIN "user" u ON o.user_id = u.id
             JOIN orderitem oi ON o.id = oi.order_id
             JOIN artwork a ON oi.artwork_id = a.id
-            ORDER BY o.order_date DESC;
+            ORDER BY o.order_date DESC, o.id DESC, oi.id;
         """)
-        orders = cur.fetchall()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cur.fetchmany(EXPORT_ITERSIZE)
+            if not rows:
+                break
+            if export_format == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            # пустая выгрузка: только заголовок CSV
+            yield buffer.getvalue()
         cur.close()
-        conn.close()
-
-        orders_dict = {}
-        for order in orders:
-            order_id = order[0]
-            if order_id not in orders_dict:
-                orders_dict[order_id] = {
-                    'order_date': order[1].strftime('%Y-%m-%d %H:%M:%S'),
-                    'status': order[2],
-                    'username': order[3],
-                    'items': []
-                }
-            orders_dict[order_id]['items'].append({
-                'artwork_id': order[4],
-                'title': order[5],
-                'quantity': order[6],
-                'price': float(order[7])
-            })
-
-        orders_list = []
-        for order_id, details in orders_dict.items():
-            orders_list.append({
-                'order_id': order_id,
-                'order_date': details['order_date'],
-                'status': details['status'],
-                'username': details['username'],
-                'items': details['items']
-            })
 
-        return jsonify(orders_list), 200
+@api.route('/admin/orders/export', methods=['GET'])
+def export_orders():
+    user_id = request.args.get('user_id')
+    export_format = request.args.get('format', 'ndjson')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+
+    try:
+        if get_user_role(user_id) != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_orders_export(export_format), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=orders.{export_format}'
+    return response
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # режим разработки; в проде - gunicorn -c gunicorn.conf.py wsgi:app
+    start_reservation_sweeper(on_released=refresh_cached_stock_for)
+    create_app().run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
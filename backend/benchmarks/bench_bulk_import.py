@@ -0,0 +1,82 @@
+"""Benchmark: bulk catalog import throughput through /admin/artworks/import.
+
+Generates ROWS synthetic artworks as CSV, posts them through the Flask test
+client and prints rows/s, then imports the same file again (all updates).
+Bench artworks are deleted afterwards. Needs Postgres and Redis.
+
+    python benchmarks/bench_bulk_import.py [rows]
+"""
+import io
+import os
+import sys
+import csv
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from db_config import db_connection, close_pool
+
+
+def build_csv(rows, category):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['title', 'description', 'price', 'category', 'stock'])
+    for i in range(rows):
+        writer.writerow([f"bench import {i}", f"Описание {i}", f"{100 + i % 1000}.50", category, i % 20])
+    return buffer.getvalue().encode('utf-8')
+
+
+def admin_and_category():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT u.id FROM "user" u
+            JOIN role r ON u.role_id = r.id
+            WHERE r.name = 'admin'
+            LIMIT 1;
+        """)
+        admin_id = cur.fetchone()[0]
+        cur.execute("SELECT name FROM category ORDER BY id LIMIT 1;")
+        category = cur.fetchone()[0]
+        cur.close()
+    return admin_id, category
+
+
+def cleanup():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM inventory WHERE artwork_id IN (SELECT id FROM artwork WHERE title LIKE 'bench import %%');")
+        cur.execute("DELETE FROM artwork WHERE title LIKE 'bench import %%';")
+        conn.commit()
+        cur.close()
+
+
+def run(client, admin_id, payload, label, rows):
+    t0 = time.perf_counter()
+    response = client.post('/admin/artworks/import', data={
+        'user_id': admin_id,
+        'file': (io.BytesIO(payload), 'catalog.csv')
+    }, content_type='multipart/form-data')
+    elapsed = time.perf_counter() - t0
+    report = response.get_json()
+    print(f"{label}: status={response.status_code} inserted={report.get('inserted')} "
+          f"updated={report.get('updated')} errors={report.get('error_count')} "
+          f"in {elapsed:.2f}s -> {rows / elapsed:.0f} rows/s")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    admin_id, category = admin_and_category()
+    payload = build_csv(rows, category)
+    client = create_app().test_client()
+    try:
+        run(client, admin_id, payload, 'insert', rows)
+        run(client, admin_id, payload, 'update', rows)
+    finally:
+        cleanup()
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark: concurrent checkout throughput and oversell check.
+
+Creates a few bench artworks with limited stock, then many threads check out
+random carts through create_order_items_proc at the same time. At the end the
+sold quantity must equal the stock decrease and no stock may go negative.
+Needs a running Postgres with ddl.sql applied (POSTGRES_* / DB_* env vars).
+
+    python benchmarks/bench_checkout.py [threads] [orders_per_thread]
+"""
+import os
+import sys
+import time
+import random
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DB_POOL_MAX', '64')
+
+from psycopg2.errors import RaiseException
+from db_config import db_connection, close_pool
+
+ARTWORKS = 5
+INITIAL_STOCK = 200
+
+
+def setup():
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO "user" (username, email, password_hash, role_id)
+            VALUES ('bench_checkout', 'bench_checkout@example.com', '-', (SELECT id FROM role WHERE name = 'regular_user'))
+            ON CONFLICT (username) DO UPDATE SET email = EXCLUDED.email
+            RETURNING id;
+        """)
+        user_id = cur.fetchone()[0]
+        artwork_ids = []
+        for i in range(ARTWORKS):
+            cur.execute("CALL add_artwork_proc(%s, %s, %s, (SELECT id FROM category ORDER BY id LIMIT 1), NULL, 0);",
+                        (f"bench checkout {i}", 'bench', 100))
+            cur.execute("SELECT id FROM artwork WHERE title = %s;", (f"bench checkout {i}",))
+            artwork_id = cur.fetchone()[0]
+            cur.execute("UPDATE inventory SET stock = %s WHERE artwork_id = %s;", (INITIAL_STOCK, artwork_id))
+            artwork_ids.append(artwork_id)
+        conn.commit()
+        cur.close()
+    return user_id, artwork_ids
+
+
+def teardown(user_id, artwork_ids):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for artwork_id in artwork_ids:
+            cur.execute("CALL delete_artwork_proc(%s);", (artwork_id,))
+        cur.execute('DELETE FROM "order" WHERE user_id = %s;', (user_id,))
+        cur.execute('DELETE FROM "user" WHERE id = %s;', (user_id,))
+        conn.commit()
+        cur.close()
+
+
+def worker(user_id, artwork_ids, orders, stats, lock):
+    rnd = random.Random()
+    for _ in range(orders):
+        cart = rnd.sample(artwork_ids, rnd.randint(1, len(artwork_ids)))
+        # перемешанный порядок позиций - процедура должна сама упорядочить блокировки
+        quantities = [rnd.randint(1, 3) for _ in cart]
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("CALL create_order_items_proc(%s, %s, %s, NULL);", (user_id, cart, quantities))
+                conn.commit()
+                key = 'ok'
+            except RaiseException:
+                conn.rollback()
+                key = 'out_of_stock'
+            cur.close()
+        with lock:
+            stats[key] += 1
+
+
+def check(user_id, artwork_ids):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT i.artwork_id, i.stock, COALESCE(sum(oi.quantity), 0)
+            FROM inventory i
+            LEFT JOIN orderitem oi ON oi.artwork_id = i.artwork_id
+            WHERE i.artwork_id = ANY(%s)
+            GROUP BY i.artwork_id, i.stock;
+        """, (artwork_ids,))
+        rows = cur.fetchall()
+        cur.close()
+    oversold = 0
+    for artwork_id, stock, sold in rows:
+        if stock < 0 or stock + sold != INITIAL_STOCK:
+            oversold += 1
+            print(f"artwork {artwork_id}: stock={stock} sold={sold} (expected {INITIAL_STOCK})")
+    return oversold
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    user_id, artwork_ids = setup()
+    stats = {'ok': 0, 'out_of_stock': 0}
+    lock = threading.Lock()
+    try:
+        pool = [threading.Thread(target=worker, args=(user_id, artwork_ids, orders, stats, lock))
+                for _ in range(threads)]
+        t0 = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        total = stats['ok'] + stats['out_of_stock']
+        print(f"threads={threads} checkouts={total} in {elapsed:.2f}s -> {total / elapsed:.1f}/s")
+        print(f"committed={stats['ok']} rejected_out_of_stock={stats['out_of_stock']}")
+        print(f"oversold artworks: {check(user_id, artwork_ids)}")
+    finally:
+        teardown(user_id, artwork_ids)
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()
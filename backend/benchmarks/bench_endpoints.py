@@ -0,0 +1,371 @@
+"""Benchmark: latency and throughput of the main API endpoints on generated data.
+
+Load data first with generate_data.py, start the backend, then run the
+scenarios one after another, each with --concurrency threads for --seconds:
+
+    python benchmarks/generate_data.py --artworks 1000000 --reviews 2000000 --orders 500000
+    gunicorn -c gunicorn.conf.py wsgi:app
+    python benchmarks/bench_endpoints.py --url http://localhost:8000 --concurrency 32 --seconds 20
+    python benchmarks/bench_endpoints.py --compare benchmarks/results/<older>.json
+
+--in-process drives the Flask test client instead of HTTP (no server needed,
+but it measures the app without the WSGI server). Ids are sampled from the
+generated rows (--prefix), so Postgres must be reachable (POSTGRES_* / DB_*).
+Only failed logins count toward the login rate limits, so the login mix (which
+uses the generated password) is not throttled; 429s there mean a wrong --password.
+create_order decrements stock of generated artworks only.
+Results go to benchmarks/results/<timestamp>-<sha>.json.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlencode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from db_config import db_connection, close_pool
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+SAMPLE_SIZE = 5000
+# сколько страниц листаем по курсору, прежде чем начать с начала
+MAX_PAGES = 10
+SEARCH_TERMS = ['пейзаж', 'море закат', 'портрет', 'золотой собор', 'акварель', 'зимний лес', 'подсолнух']
+RATE_LIMIT_ENV = ['LOGIN_RATE_LIMIT_IP', 'LOGIN_RATE_LIMIT_USERNAME', 'REGISTER_RATE_LIMIT_IP']
+
+
+def sample_ids(prefix):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # starts_with: "_" в префиксе для LIKE был бы подстановочным символом
+        cur.execute('SELECT id, username FROM "user" WHERE starts_with(username, %s) LIMIT %s;', (f"{prefix}_user_", SAMPLE_SIZE))
+        users = cur.fetchall()
+        cur.execute("SELECT id FROM artwork WHERE starts_with(title, %s) LIMIT %s;", (f"{prefix} ", SAMPLE_SIZE))
+        artworks = [row[0] for row in cur.fetchall()]
+        # у популярных работ много отзывов - там видно пагинацию
+        cur.execute("""
+            SELECT id FROM artwork WHERE starts_with(title, %s) AND rating_count > 0
+            ORDER BY rating_count DESC LIMIT 100;
+        """, (f"{prefix} ",))
+        popular = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT name FROM category ORDER BY id;")
+        categories = [row[0] for row in cur.fetchall()]
+        cur.close()
+    if not users or not artworks:
+        raise SystemExit(f"No generated rows with prefix '{prefix}', run generate_data.py first")
+    return {'users': users, 'artworks': artworks, 'popular': popular or artworks, 'categories': categories}
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        # keep-alive соединение на поток
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, self.prefix + path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status, response.headers
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code, response.headers
+
+    def close(self):
+        pass
+
+
+class Recorder:
+    """Per-label latencies and outcome counters, merged from worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.labels = {}
+
+    def merge(self, local):
+        with self.lock:
+            for label, stats in local.items():
+                total = self.labels.setdefault(label, {'latencies': [], 'rejected': 0, 'throttled': 0, 'errors': 0})
+                total['latencies'].extend(stats['latencies'])
+                for key in ('rejected', 'throttled', 'errors'):
+                    total[key] += stats[key]
+
+
+def timed(client, local, label, method, path, body=None):
+    stats = local.setdefault(label, {'latencies': [], 'rejected': 0, 'throttled': 0, 'errors': 0})
+    t0 = time.perf_counter()
+    try:
+        status, headers = client.request(method, path, body)
+    except Exception:
+        stats['errors'] += 1
+        return None, None
+    elapsed = time.perf_counter() - t0
+    if status == 429:
+        stats['throttled'] += 1
+    elif status >= 500:
+        stats['errors'] += 1
+    elif status >= 400:
+        # например, нет товара на складе - это ответ приложения, а не сбой
+        stats['rejected'] += 1
+    else:
+        stats['latencies'].append(elapsed)
+    return status, headers
+
+
+def with_query(path, params):
+    params = {key: value for key, value in params.items() if value is not None}
+    return f"{path}?{urlencode(params)}" if params else path
+
+
+def paginate(client, local, label, path, params, state, cursor_params):
+    # идем по курсору X-Next-*, после MAX_PAGES страниц или конца выдачи начинаем заново
+    cursor = state.get(label)
+    status, headers = timed(client, local, label, 'GET', with_query(path, {**params, **(cursor or {})}))
+    pages = state.get(f"{label}:pages", 0) + 1
+    if status == 200 and headers.get('X-Next-Cursor') and pages < MAX_PAGES:
+        state[label] = {param: headers.get(header) for param, header in cursor_params.items()}
+        state[f"{label}:pages"] = pages
+    else:
+        state.pop(label, None)
+        state[f"{label}:pages"] = 0
+
+
+def catalog(client, local, rnd, ids, state):
+    paginate(client, local, 'catalog', '/artworks', {'limit': 20}, state, {'after_id': 'X-Next-Cursor'})
+
+
+def catalog_rating(client, local, rnd, ids, state):
+    params = {'limit': 20, 'sort': 'rating'}
+    paginate(client, local, 'catalog_rating', '/artworks', params, state,
+             {'after_id': 'X-Next-Cursor', 'after_rating': 'X-Next-Rating'})
+
+
+def catalog_filtered(client, local, rnd, ids, state):
+    low = rnd.choice([100, 1000, 10000, 100000])
+    params = {'limit': 20, 'min_price': low, 'max_price': low * 10, 'in_stock': 'true'}
+    if ids['categories'] and rnd.random() < 0.5:
+        params['category'] = rnd.choice(ids['categories'])
+    timed(client, local, 'catalog_filtered', 'GET', with_query('/artworks', params))
+
+
+def reviews(client, local, rnd, ids, state):
+    artwork_id = state.setdefault('reviews:artwork', rnd.choice(ids['popular']))
+    paginate(client, local, 'reviews', f"/reviews/{artwork_id}", {'limit': 20}, state,
+             {'after_id': 'X-Next-Cursor', 'after_date': 'X-Next-Date'})
+    if 'reviews' not in state:
+        state['reviews:artwork'] = rnd.choice(ids['popular'])
+
+
+def user_orders(client, local, rnd, ids, state):
+    user_id = rnd.choice(ids['users'])[0]
+    timed(client, local, 'user_orders', 'GET', f"/orders/{user_id}?limit=20")
+
+
+def admin_orders(client, local, rnd, ids, state):
+    paginate(client, local, 'admin_orders', '/admin/orders', {'limit': 50}, state,
+             {'after_id': 'X-Next-Cursor', 'after_date': 'X-Next-Date'})
+
+
+def search(client, local, rnd, ids, state):
+    params = {'q': rnd.choice(SEARCH_TERMS), 'limit': 20}
+    if rnd.random() < 0.3:
+        params['offset'] = 20
+    timed(client, local, 'search', 'GET', with_query('/search', params))
+
+
+def login_order_mix(client, local, rnd, ids, state):
+    # вход и покупка одной-двух случайных работ
+    user_id, username = rnd.choice(ids['users'])
+    timed(client, local, 'mix:login', 'POST', '/login', {'username': username, 'password': state['password']})
+    items = [{'artwork_id': artwork_id, 'quantity': 1} for artwork_id in rnd.sample(ids['artworks'], rnd.randint(1, 2))]
+    timed(client, local, 'mix:create_order', 'POST', '/create_order', {'user_id': user_id, 'items': items})
+
+
+SCENARIOS = {
+    'catalog': catalog,
+    'catalog_rating': catalog_rating,
+    'catalog_filtered': catalog_filtered,
+    'reviews': reviews,
+    'user_orders': user_orders,
+    'admin_orders': admin_orders,
+    'search': search,
+    'login_order_mix': login_order_mix
+}
+
+
+def run_scenario(name, make_client, ids, args, recorder, seed):
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(index):
+        rnd = random.Random(seed * 1000 + index)
+        client = make_client()
+        local, state = {}, {'password': args.password}
+        try:
+            while time.perf_counter() < deadline:
+                SCENARIOS[name](client, local, rnd, ids, state)
+        finally:
+            client.close()
+            recorder.merge(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0.0
+
+
+def summarize(stats, seconds):
+    latencies = sorted(stats['latencies'])
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'rejected': stats['rejected'],
+        'throttled': stats['throttled'],
+        'errors': stats['errors']
+    }
+
+
+def git_sha():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def print_results(results):
+    print(f"{'label':<20} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'4xx':>6} {'429':>6} {'err':>5}")
+    for label, r in results.items():
+        print(f"{label:<20} {r['rps']:>9.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['max_ms']:>8.1f} {r['rejected']:>6} {r['throttled']:>6} {r['errors']:>5}")
+
+
+def compare(old_path, results):
+    with open(old_path) as f:
+        old = json.load(f)
+    print(f"\nCompared with {old_path} (sha {old.get('git_sha')}, {old.get('timestamp')}):")
+    print(f"{'label':<20} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for label, r in results.items():
+        before = old['results'].get(label)
+        if not before:
+            continue
+        deltas = []
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            deltas.append(f"{(r[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else 'n/a')
+        print(f"{label:<20} {deltas[0]:>9} {deltas[1]:>9} {deltas[2]:>9} {deltas[3]:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--in-process', action='store_true', help='use the Flask test client instead of HTTP')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--prefix', default='gen')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--output', help='result file, default benchmarks/results/<timestamp>-<sha>.json')
+    parser.add_argument('--compare', help='earlier result file to print deltas against')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    ids = sample_ids(args.prefix)
+    if args.in_process:
+        from app import create_app
+        app = create_app()
+        make_client = lambda: InProcessClient(app)
+    else:
+        make_client = lambda: HttpClient(args.url)
+
+    results = {}
+    try:
+        for i, name in enumerate(names):
+            print(f"Running {name} ({args.concurrency} threads, {args.seconds}s)...")
+            recorder = Recorder()
+            run_scenario(name, make_client, ids, args, recorder, args.seed + i)
+            for label, stats in recorder.labels.items():
+                results[label] = summarize(stats, args.seconds)
+    finally:
+        close_pool()
+
+    print()
+    print_results(results)
+    if any(r['throttled'] for r in results.values()):
+        print("\nSome requests were throttled (429): check --password or raise "
+              f"{', '.join(RATE_LIMIT_ENV)} on the server")
+
+    report = {
+        'git_sha': git_sha(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {
+            **{key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'password')},
+            'scenarios': names,
+            # лимиты из окружения бенчмарка; выставьте те же на сервере
+            'rate_limits': {key: os.getenv(key) for key in RATE_LIMIT_ENV},
+            'sample': {key: len(value) for key, value in ids.items()}
+        },
+        'results': results
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['git_sha']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: streaming /admin/orders/export on a large order history.
+
+Bulk-inserts bench orders (ITEMS order items in total) with generate_series,
+streams the export through the Flask test client and reports rows/s and the
+peak Python memory seen by tracemalloc while streaming. Bench rows are removed
+afterwards. Needs Postgres and Redis (POSTGRES_* / DB_* / REDIS_* env vars).
+
+    python benchmarks/bench_orders_export.py [items] [ndjson|csv]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from db_config import db_connection, close_pool
+
+ITEMS_PER_ORDER = 10
+
+
+def setup(items):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO "user" (username, email, password_hash, role_id)
+            VALUES ('bench_export', 'bench_export@example.com', '-', (SELECT id FROM role WHERE name = 'regular_user'))
+            ON CONFLICT (username) DO UPDATE SET email = EXCLUDED.email
+            RETURNING id;
+        """)
+        user_id = cur.fetchone()[0]
+        cur.execute("""
+            SELECT u.id FROM "user" u
+            JOIN role r ON u.role_id = r.id
+            WHERE r.name = 'admin'
+            LIMIT 1;
+        """)
+        admin_id = cur.fetchone()[0]
+        cur.execute("SELECT id FROM artwork ORDER BY id LIMIT 1;")
+        artwork_id = cur.fetchone()[0]
+        cur.execute("""
+            WITH orders AS (
+                INSERT INTO "order" (user_id, order_date, status)
+                SELECT %s, now() - make_interval(secs => g), 'bench'
+                FROM generate_series(1, %s) AS g
+                RETURNING id
+            )
+            INSERT INTO orderitem (order_id, artwork_id, quantity, price)
+            SELECT orders.id, %s, 1, 100
+            FROM orders, generate_series(1, %s);
+        """, (user_id, items // ITEMS_PER_ORDER, artwork_id, ITEMS_PER_ORDER))
+        conn.commit()
+        cur.close()
+    return user_id, admin_id
+
+
+def teardown(user_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM orderitem WHERE order_id IN (SELECT id FROM "order" WHERE user_id = %s);', (user_id,))
+        cur.execute('DELETE FROM "order" WHERE user_id = %s;', (user_id,))
+        cur.execute('DELETE FROM "user" WHERE id = %s;', (user_id,))
+        conn.commit()
+        cur.close()
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    export_format = sys.argv[2] if len(sys.argv) > 2 else 'ndjson'
+    user_id, admin_id = setup(items)
+    try:
+        client = create_app().test_client()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        response = client.get(f"/admin/orders/export?user_id={admin_id}&format={export_format}", buffered=False)
+        lines = 0
+        size = 0
+        for chunk in response.response:
+            lines += chunk.count(b'\n') if isinstance(chunk, bytes) else chunk.count('\n')
+            size += len(chunk)
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"format={export_format} lines={lines} size={size / 1e6:.1f}MB in {elapsed:.1f}s "
+              f"-> {lines / elapsed:.0f} rows/s, peak python memory {peak / 1e6:.1f}MB")
+    finally:
+        teardown(user_id)
+        close_pool()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Benchmark: HTTP throughput/latency of one backend instance.
+
+Run it once against the dev server and once against gunicorn and compare:
+
+    python app.py                                   # dev: Werkzeug, debug=True
+    gunicorn -c gunicorn.conf.py wsgi:app           # prod
+    python benchmarks/bench_server_modes.py http://localhost:8000/artworks?limit=20 [concurrency] [seconds]
+"""
+import sys
+import time
+import threading
+import statistics
+import http.client
+from urllib.parse import urlsplit
+
+
+def worker(url, deadline, latencies, errors, lock):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    # keep-alive соединение на поток, как у нормального клиента
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    local, failed = [], 0
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                failed += 1
+            else:
+                local.append(time.perf_counter() - t0)
+        except Exception:
+            failed += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    conn.close()
+    with lock:
+        latencies.extend(local)
+        errors[0] += failed
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0.0
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:8000/artworks?limit=20'
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 15
+    latencies, errors, lock = [], [0], threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=worker, args=(url, deadline, latencies, errors, lock)) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    print(f"url={url} concurrency={concurrency} duration={seconds}s")
+    print(f"requests={len(latencies)} errors={errors[0]} rps={len(latencies) / seconds:.1f}")
+    if latencies:
+        print(f"p50={percentile(latencies, 0.50):.1f}ms p95={percentile(latencies, 0.95):.1f}ms "
+              f"p99={percentile(latencies, 0.99):.1f}ms mean={statistics.mean(latencies) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
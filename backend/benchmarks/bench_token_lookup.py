@@ -0,0 +1,66 @@
+"""Benchmark: token -> user_id lookup latency vs number of live sessions.
+
+Compares the old SCAN over user_token:* with the token:<hash> reverse index.
+Needs a running Redis (REDIS_HOST / REDIS_PORT), writes keys with the
+"bench-" user prefix and removes them afterwards.
+
+    python benchmarks/bench_token_lookup.py
+"""
+import os
+import sys
+import time
+import secrets
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redis_config import redis_client, store_token, delete_token, get_user_id_by_token
+
+SESSION_COUNTS = [10, 100, 1000, 10000, 100000]
+LOOKUPS = 200
+SCAN_LIMIT = 1000  # дальше SCAN слишком долгий
+
+
+def scan_lookup(token):
+    # старая реализация verify_token
+    for key in redis_client.scan_iter("user_token:*"):
+        if redis_client.get(key) == token:
+            return key.split(':')[1]
+    return None
+
+
+def populate(start, stop, tokens):
+    for i in range(start, stop):
+        token = secrets.token_hex(32)
+        store_token(f"bench-{i}", token)
+        tokens.append(token)
+
+
+def measure(lookup, tokens, n):
+    samples = []
+    for _ in range(n):
+        token = tokens[secrets.randbelow(len(tokens))]
+        t0 = time.perf_counter()
+        assert lookup(token) is not None
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    tokens = []
+    try:
+        print(f"{'sessions':>10} {'index p50 ms':>14} {'index max ms':>14} {'scan p50 ms':>13}")
+        for count in SESSION_COUNTS:
+            populate(len(tokens), count, tokens)
+            p50, worst = measure(get_user_id_by_token, tokens, LOOKUPS)
+            scan = "-"
+            if count <= SCAN_LIMIT:
+                scan = f"{measure(scan_lookup, tokens, 20)[0]:.3f}"
+            print(f"{count:>10} {p50:>14.3f} {worst:>14.3f} {scan:>13}")
+    finally:
+        for i in range(len(tokens)):
+            delete_token(f"bench-{i}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""Synthetic data generator: bulk-loads users, artworks, inventory, reviews and orders.
+
+Rows go through COPY FROM STDIN streamed from Python generators and are never
+held in memory; only the generated ids and artwork prices are, so memory grows
+with --users + --artworks + --orders (tens of MB per million). The same --seed
+gives the same data.
+Generated rows are tagged with --prefix (usernames and titles) so --drop can
+remove them again. All generated users share the password --password, which
+bench_endpoints.py uses for its login mix. Needs Postgres (POSTGRES_* / DB_*).
+
+    python benchmarks/generate_data.py --users 100000 --artworks 1000000 --reviews 2000000 --orders 500000
+    python benchmarks/generate_data.py --drop
+"""
+import io
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+from bulk_import import IteratorFile
+from db_config import db_connection, close_pool
+
+WORDS = [
+    'пейзаж', 'портрет', 'натюрморт', 'море', 'закат', 'город', 'лес', 'река', 'горы', 'ночь',
+    'утро', 'цветы', 'подсолнухи', 'дождь', 'зима', 'осень', 'весна', 'лето', 'мост', 'собор',
+    'абстракция', 'бронза', 'мрамор', 'масло', 'акварель', 'графика', 'фотография', 'скульптура',
+    'старый', 'новый', 'синий', 'красный', 'золотой', 'тихий', 'светлый', 'темный', 'большой', 'малый'
+]
+COMMENTS = ['Прекрасная работа', 'Неплохо', 'Ожидал большего', 'Шедевр', 'Хорошее качество', 'Дорого, но стоит того']
+STATUSES = ['pending', 'paid', 'shipped', 'delivered', 'cancelled']
+DAYS_OF_HISTORY = 3 * 365
+
+
+def csv_lines(rows):
+    # строки для COPY ... WITH (FORMAT csv) без накопления в памяти
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def copy_rows(cur, table, columns, rows):
+    start = time.perf_counter()
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+        IteratorFile(csv_lines(rows))
+    )
+    print(f"  {table}: {cur.rowcount} rows in {time.perf_counter() - start:.1f}s")
+
+
+def reserve_ids(cur, table, count):
+    # id берем из последовательности заранее, чтобы ссылаться на них в следующих COPY
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s);",
+        (table, count)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def random_date(rnd, now):
+    return now - timedelta(seconds=rnd.randint(0, DAYS_OF_HISTORY * 24 * 3600))
+
+
+def generate(args):
+    rnd = random.Random(args.seed)
+    now = datetime(2025, 1, 1)
+    password_hash = generate_password_hash(args.password)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM role WHERE name = 'regular_user';")
+        role_id = cur.fetchone()[0]
+        cur.execute("SELECT id FROM category ORDER BY id;")
+        category_ids = [row[0] for row in cur.fetchall()]
+
+        print("Loading users...")
+        user_ids = reserve_ids(cur, '"user"', args.users)
+        copy_rows(cur, '"user"', ['id', 'username', 'email', 'password_hash', 'role_id'], (
+            (user_id, f"{args.prefix}_user_{i}", f"{args.prefix}_user_{i}@example.com", password_hash, role_id)
+            for i, user_id in enumerate(user_ids)
+        ))
+
+        print("Loading artworks...")
+        artwork_ids = reserve_ids(cur, 'artwork', args.artworks)
+        # цены по позиции в artwork_ids, для позиций заказов
+        prices = []
+
+        def artworks():
+            for i, artwork_id in enumerate(artwork_ids):
+                price = round(rnd.uniform(100, 1_000_000), 2)
+                prices.append(price)
+                words = rnd.sample(WORDS, 3)
+                yield (
+                    artwork_id,
+                    f"{args.prefix} {' '.join(words[:2])} {i}",
+                    f"{words[2].capitalize()}: {' '.join(rnd.choices(WORDS, k=12))}",
+                    price,
+                    rnd.choice(category_ids),
+                    None
+                )
+
+        copy_rows(cur, 'artwork', ['id', 'title', 'description', 'price', 'category_id', 'photo_url'], artworks())
+        copy_rows(cur, 'inventory', ['artwork_id', 'stock'], (
+            (artwork_id, rnd.randint(0, 50)) for artwork_id in artwork_ids
+        ))
+
+        print("Loading reviews...")
+        # агрегаты рейтинга считаем одним запросом после загрузки, а не триггером на каждую строку.
+        # Флаг действует только в этой транзакции и не берет блокировку таблицы, в отличие от DISABLE TRIGGER
+        cur.execute("SET LOCAL app.skip_review_aggregates = 'on';")
+        copy_rows(cur, 'reviews', ['user_id', 'artwork_id', 'rating', 'comment', 'review_date'], (
+            (
+                rnd.choice(user_ids),
+                # немного популярных работ собирают большую часть отзывов
+                artwork_ids[min(int(rnd.paretovariate(1.2)) - 1, len(artwork_ids) - 1)] if rnd.random() < 0.5 else rnd.choice(artwork_ids),
+                rnd.randint(1, 5),
+                rnd.choice(COMMENTS),
+                random_date(rnd, now)
+            )
+            for _ in range(args.reviews)
+        ))
+        cur.execute("SET LOCAL app.skip_review_aggregates = 'off';")
+        # включая last_review_date: триггер его тоже не обновлял
+        cur.execute("""
+            UPDATE artwork a
+            SET rating_sum = r.rating_sum,
+                rating_count = r.rating_count,
+                rating_avg = round(r.rating_sum::NUMERIC / r.rating_count, 2),
+                last_review_date = r.last_review_date
+            FROM (
+                SELECT artwork_id, sum(rating) AS rating_sum, count(*) AS rating_count, max(review_date) AS last_review_date
+                FROM reviews
+                WHERE artwork_id = ANY(%s)
+                GROUP BY artwork_id
+            ) r
+            WHERE a.id = r.artwork_id;
+        """, (artwork_ids,))
+
+        print("Loading orders...")
+        order_ids = reserve_ids(cur, '"order"', args.orders)
+        copy_rows(cur, '"order"', ['id', 'user_id', 'order_date', 'status'], (
+            (order_id, rnd.choice(user_ids), random_date(rnd, now), rnd.choice(STATUSES))
+            for order_id in order_ids
+        ))
+
+        def order_items():
+            for order_id in order_ids:
+                for index in rnd.sample(range(len(artwork_ids)), min(rnd.randint(1, args.items_per_order), len(artwork_ids))):
+                    yield order_id, artwork_ids[index], rnd.randint(1, 3), prices[index]
+
+        copy_rows(cur, 'orderitem', ['order_id', 'artwork_id', 'quantity', 'price'], order_items())
+
+        conn.commit()
+        # свежая статистика, иначе планировщик считает таблицы пустыми
+        for table in ('"user"', 'artwork', 'inventory', 'reviews', '"order"', 'orderitem'):
+            cur.execute(f"ANALYZE {table};")
+        conn.commit()
+        cur.close()
+
+
+def drop(args):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # starts_with, а не LIKE: "_" в префиксе - подстановочный символ LIKE и задел бы чужие строки
+        users = f"{args.prefix}_user_"
+        titles = f"{args.prefix} "
+        cur.execute("""
+            DELETE FROM orderitem WHERE order_id IN (
+                SELECT o.id FROM "order" o JOIN "user" u ON o.user_id = u.id WHERE starts_with(u.username, %s)
+            ) OR artwork_id IN (SELECT id FROM artwork WHERE starts_with(title, %s));
+        """, (users, titles))
+        cur.execute('DELETE FROM "order" WHERE user_id IN (SELECT id FROM "user" WHERE starts_with(username, %s));', (users,))
+        cur.execute("""
+            DELETE FROM reviews
+            WHERE user_id IN (SELECT id FROM "user" WHERE starts_with(username, %s))
+               OR artwork_id IN (SELECT id FROM artwork WHERE starts_with(title, %s));
+        """, (users, titles))
+        cur.execute("DELETE FROM reservation WHERE artwork_id IN (SELECT id FROM artwork WHERE starts_with(title, %s));", (titles,))
+        cur.execute("DELETE FROM inventory WHERE artwork_id IN (SELECT id FROM artwork WHERE starts_with(title, %s));", (titles,))
+        cur.execute("DELETE FROM artwork WHERE starts_with(title, %s);", (titles,))
+        cur.execute('DELETE FROM reservation WHERE user_id IN (SELECT id FROM "user" WHERE starts_with(username, %s));', (users,))
+        cur.execute('DELETE FROM "user" WHERE starts_with(username, %s);', (users,))
+        conn.commit()
+        cur.close()
+    print(f"Removed generated rows with prefix '{args.prefix}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--artworks', type=int, default=100_000)
+    parser.add_argument('--reviews', type=int, default=200_000)
+    parser.add_argument('--orders', type=int, default=50_000)
+    parser.add_argument('--items-per-order', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--prefix', default='gen')
+    parser.add_argument('--password', default='bench-password')
+    parser.add_argument('--drop', action='store_true', help='remove previously generated rows')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    try:
+        if args.drop:
+            drop(args)
+        else:
+            generate(args)
+    finally:
+        close_pool()
+    print(f"Done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import io
+import os
+import csv
+import codecs
+import json
+import shutil
+import zipfile
+import tempfile
+from werkzeug.utils import secure_filename
+from images import hashed_filename
+
+IMPORT_COLUMNS = ['title', 'description', 'price', 'category', 'stock', 'photo_url']
+MAX_REPORTED_ERRORS = int(os.getenv('IMPORT_MAX_REPORTED_ERRORS', 1000))
+
+
+class IteratorFile(io.TextIOBase):
+    """Read-only file over an iterator of strings, so COPY can stream rows without buffering them all."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def iter_records(stream, import_format):
+    text = codecs.getreader('utf-8-sig')(stream)
+    if import_format == 'csv':
+        for record in csv.DictReader(text):
+            yield record, None
+    else:
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield {}, 'invalid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield {}, 'invalid JSON'
+                continue
+            yield record, None
+
+
+class ImageArchive:
+    """Extracts photos referenced by import rows from an optional zip archive."""
+
+    def __init__(self, archive, upload_folder):
+        self._zip = zipfile.ZipFile(archive) if archive else None
+        self._names = set(self._zip.namelist()) if self._zip else set()
+        self._upload_folder = upload_folder
+        self._extracted = {}
+
+    def resolve(self, photo):
+        if not photo or photo not in self._names:
+            return photo
+        if photo not in self._extracted:
+            with self._zip.open(photo) as source, tempfile.TemporaryFile() as tmp:
+                shutil.copyfileobj(source, tmp)
+                tmp.seek(0)
+                unique_filename = hashed_filename(tmp, secure_filename(os.path.basename(photo)))
+                with open(os.path.join(self._upload_folder, unique_filename), 'wb') as target:
+                    shutil.copyfileobj(tmp, target)
+            self._extracted[photo] = f"/static/uploads/{unique_filename}"
+        return self._extracted[photo]
+
+
+def iter_copy_lines(records, images):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line_no, (record, error) in enumerate(records, start=1):
+        values = [record.get(column) for column in IMPORT_COLUMNS]
+        values[-1] = images.resolve(values[-1] or record.get('photo'))
+        values.append(error)
+        writer.writerow([line_no] + ['' if value is None else str(value) for value in values])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def import_artworks(conn, stream, import_format, archive=None, upload_folder=None):
+    """COPY rows into a staging table, validate and upsert them set-based. Returns a report dict."""
+    images = ImageArchive(archive, upload_folder)
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE artwork_import (
+            line_no INTEGER,
+            title TEXT,
+            description TEXT,
+            price TEXT,
+            category TEXT,
+            stock TEXT,
+            photo_url TEXT,
+            category_id INTEGER,
+            error TEXT
+        ) ON COMMIT DROP;
+    """)
+    cur.copy_expert(
+        "COPY artwork_import (line_no, title, description, price, category, stock, photo_url, error) "
+        "FROM STDIN WITH (FORMAT csv, NULL '')",
+        IteratorFile(iter_copy_lines(iter_records(stream, import_format), images))
+    )
+
+    # Проверка строк набором запросов, без цикла по строкам
+    cur.execute("""
+        ANALYZE artwork_import;
+
+        UPDATE artwork_import s
+        SET category_id = c.id
+        FROM category c
+        WHERE c.name = s.category;
+
+        UPDATE artwork_import s
+        SET error = CASE
+            WHEN s.error IS NOT NULL THEN s.error
+            WHEN s.title IS NULL OR btrim(s.title) = '' THEN 'title is required'
+            WHEN length(s.title) > 200 THEN 'title is too long'
+            WHEN s.price IS NULL OR s.price !~ '^\\d{1,8}(\\.\\d{1,2})?$' THEN 'invalid price'
+            WHEN s.stock IS NOT NULL AND s.stock !~ '^\\d{1,9}$' THEN 'invalid stock'
+            WHEN s.category_id IS NULL THEN 'unknown category'
+            WHEN length(s.photo_url) > 255 THEN 'photo_url is too long'
+        END;
+
+        UPDATE artwork_import s
+        SET error = 'duplicate title in file, later line wins'
+        FROM (
+            SELECT line_no, row_number() OVER (PARTITION BY title ORDER BY line_no DESC) AS rn
+            FROM artwork_import
+            WHERE error IS NULL
+        ) d
+        WHERE d.line_no = s.line_no AND d.rn > 1;
+    """)
+
+    # Вставка/обновление артикулов и остатков
+    cur.execute("""
+        WITH upserted AS (
+            INSERT INTO artwork (title, description, price, category_id, photo_url)
+            SELECT s.title, s.description, s.price::NUMERIC, s.category_id, s.photo_url
+            FROM artwork_import s
+            WHERE s.error IS NULL
+            ON CONFLICT (title) DO UPDATE
+            SET description = EXCLUDED.description,
+                price = EXCLUDED.price,
+                category_id = EXCLUDED.category_id,
+                photo_url = COALESCE(EXCLUDED.photo_url, artwork.photo_url)
+            RETURNING artwork.id, artwork.title, (xmax = 0) AS inserted
+        ), stocked AS (
+            INSERT INTO inventory (artwork_id, stock)
+            SELECT u.id, s.stock::INTEGER
+            FROM upserted u
+            JOIN artwork_import s ON s.title = u.title AND s.error IS NULL
+            WHERE s.stock IS NOT NULL
+            ON CONFLICT (artwork_id) DO UPDATE SET stock = EXCLUDED.stock
+            RETURNING artwork_id
+        ), unstocked AS (
+            -- остаток не указан: у существующего артикула не трогаем, новому ставим 0
+            INSERT INTO inventory (artwork_id, stock)
+            SELECT u.id, 0
+            FROM upserted u
+            JOIN artwork_import s ON s.title = u.title AND s.error IS NULL
+            WHERE s.stock IS NULL
+            ON CONFLICT (artwork_id) DO NOTHING
+            RETURNING artwork_id
+        )
+        SELECT
+            count(*) FILTER (WHERE inserted),
+            count(*) FILTER (WHERE NOT inserted),
+            (SELECT count(*) FROM stocked) + (SELECT count(*) FROM unstocked)
+        FROM upserted;
+    """)
+    inserted, updated, _ = cur.fetchone()
+
+    cur.execute("SELECT count(*) FROM artwork_import WHERE error IS NOT NULL;")
+    error_count = cur.fetchone()[0]
+    cur.execute("""
+        SELECT line_no, error FROM artwork_import
+        WHERE error IS NOT NULL
+        ORDER BY line_no
+        LIMIT %s;
+    """, (MAX_REPORTED_ERRORS,))
+    errors = [{'line': line_no, 'error': error} for line_no, error in cur.fetchall()]
+    cur.close()
+
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'error_count': error_count,
+        'errors': errors
+    }
@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from psycopg2 import pool, extensions
+from metrics import observe_db, DB_POOL_WAIT
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+# сколько секунд ждать свободное соединение
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class TimedCursor(extensions.cursor):
+    """Cursor that reports every statement's duration to the metrics module."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_db(time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            observe_db(time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            observe_db(time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """ThreadedConnectionPool that waits for a free connection instead of failing."""
+
+    def __init__(self, minconn, maxconn, timeout, **conn_kwargs):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **conn_kwargs)
+        self._slots = threading.Semaphore(maxconn)
+        self._lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.checked_out = 0
+        self.waiting = 0
+        self.acquired_total = 0
+        self.timeouts_total = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def getconn(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.timeout)
+        waited = time.perf_counter() - start
+        DB_POOL_WAIT.observe(waited)
+        with self._lock:
+            self.waiting -= 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            if not acquired:
+                self.timeouts_total += 1
+        if not acquired:
+            raise PoolTimeoutError(f"No free database connection after {self.timeout}s")
+
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.checked_out += 1
+            self.acquired_total += 1
+        return conn
+
+    def putconn(self, conn):
+        try:
+            # незакоммиченное не должно попасть к следующему запросу
+            if not conn.closed:
+                conn.rollback()
+            self._pool.putconn(conn, close=bool(conn.closed))
+        except Exception as e:
+            print(f"Error returning connection to pool: {str(e)}")
+            self._pool.putconn(conn, close=True)
+        finally:
+            with self._lock:
+                self.checked_out -= 1
+            self._slots.release()
+
+    def warm_up(self):
+        # открываем minconn соединений заранее; при ошибке взятые соединения возвращаем
+        conns = []
+        try:
+            for _ in range(self.minconn):
+                conns.append(self.getconn())
+                with conns[-1].cursor() as cur:
+                    cur.execute("SELECT 1;")
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'checked_out': self.checked_out,
+                'waiting': self.waiting,
+                'acquired_total': self.acquired_total,
+                'timeouts_total': self.timeouts_total,
+                'wait_time_total': round(self.wait_time_total, 6),
+                'wait_time_max': round(self.wait_time_max, 6),
+                'wait_time_avg': round(self.wait_time_total / self.acquired_total, 6) if self.acquired_total else 0.0
+            }
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    DB_POOL_TIMEOUT,
+                    dbname=os.getenv('POSTGRES_DB', 'artshop'),
+                    user=os.getenv('POSTGRES_USER', 'postgres'),
+                    password=os.getenv('POSTGRES_PASSWORD', '123'),
+                    host=os.getenv('DB_HOST', 'db'),
+                    port=os.getenv('DB_PORT', '5432'),
+                    cursor_factory=TimedCursor
+                )
+    return _pool
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection; it always goes back to the pool, even on errors."""
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    try:
+        yield conn
+    finally:
+        db_pool.putconn(conn)
+
+
+def get_pool_stats():
+    return get_pool().stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,47 @@
+import os
+import shutil
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+accesslog = os.getenv('GUNICORN_ACCESSLOG', '-')
+# приложение грузится в каждом воркере, чтобы соединения не делились между процессами
+preload_app = False
+
+
+def on_starting(server):
+    # файлы метрик прошлого запуска не должны попасть в /metrics
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    from app import warm_up, refresh_cached_stock_for
+    from reservations import start_reservation_sweeper
+
+    warm_up()
+    if os.getenv('RESERVATION_SWEEPER', '1') == '1':
+        start_reservation_sweeper(on_released=refresh_cached_stock_for)
+    worker.log.info("Worker %s warmed up", worker.pid)
+
+
+def worker_exit(server, worker):
+    from app import shut_down
+
+    shut_down()
+
+
+def child_exit(server, worker):
+    # метрики завершенного воркера больше не нужно учитывать как живые
+    from metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
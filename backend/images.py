@@ -0,0 +1,98 @@
+import os
+import re
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+# ширина производных изображений; оригинал остается как есть
+DERIVATIVE_WIDTHS = {
+    'thumb': int(os.getenv('IMAGE_THUMB_WIDTH', 320)),
+    'medium': int(os.getenv('IMAGE_MEDIUM_WIDTH', 800)),
+}
+DERIVATIVE_FORMAT = 'webp'
+DERIVATIVE_QUALITY = int(os.getenv('IMAGE_QUALITY', 80))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+DERIVED_DIR = 'derived'
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{16}_')
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='images')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def hashed_filename(stream, filename):
+    """Prefix the name with a hash of the content, so a URL never changes its bytes."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return f"{digest.hexdigest()[:16]}_{filename}"
+
+
+def is_hashed_filename(filename):
+    return bool(HASHED_NAME_RE.match(filename))
+
+
+def derivative_filename(filename, size):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(DERIVED_DIR, f"{stem}_{size}.{DERIVATIVE_FORMAT}")
+
+
+def derivative_urls(photo_url):
+    # URL одинаковые для всех размеров, размер выбирается параметром ?size=
+    if not photo_url:
+        return None
+    return {size: f"{photo_url}?size={size}" for size in DERIVATIVE_WIDTHS}
+
+
+def _generate(upload_folder, filename):
+    source_path = os.path.join(upload_folder, filename)
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            for size, width in DERIVATIVE_WIDTHS.items():
+                target_path = os.path.join(upload_folder, derivative_filename(filename, size))
+                resized = image
+                if image.width > width:
+                    resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                # пишем во временный файл, чтобы не отдать недописанный
+                tmp_path = f"{target_path}.tmp"
+                resized.save(tmp_path, format=DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY, method=4)
+                os.replace(tmp_path, target_path)
+    except Exception as e:
+        print(f"Error generating derivatives for {filename}: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(filename)
+
+
+def schedule_derivatives(upload_folder, filename):
+    """Queue thumbnail/medium generation in the background pool; duplicates are ignored."""
+    os.makedirs(os.path.join(upload_folder, DERIVED_DIR), exist_ok=True)
+    with _pending_lock:
+        if filename in _pending:
+            return
+        _pending.add(filename)
+    _executor.submit(_generate, upload_folder, filename)
+
+
+def resolve_derivative(upload_folder, filename, size):
+    """Relative path of the requested size if it is ready, else None (and generation is queued)."""
+    if size not in DERIVATIVE_WIDTHS:
+        return None
+    relative_path = derivative_filename(filename, size)
+    if os.path.exists(os.path.join(upload_folder, relative_path)):
+        return relative_path
+    if os.path.exists(os.path.join(upload_folder, filename)):
+        schedule_derivatives(upload_folder, filename)
+    return None
+
+
+def delete_derivatives(upload_folder, filename):
+    for size in DERIVATIVE_WIDTHS:
+        path = os.path.join(upload_folder, derivative_filename(filename, size))
+        if os.path.exists(path):
+            os.remove(path)
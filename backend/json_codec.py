@@ -0,0 +1,35 @@
+import json
+from decimal import Decimal
+from datetime import date, datetime
+
+# orjson необязателен: без него тот же формат дает стандартный json, только медленнее
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Compact JSON string; Decimal becomes a number, dates become ISO 8601."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default).decode()
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def join_array(items):
+    # элементы уже закодированы (например, взяты из Redis), склеиваем без разбора
+    return '[' + ','.join(items) + ']'
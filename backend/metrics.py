@@ -0,0 +1,86 @@
+import os
+import time
+import threading
+from prometheus_client import (
+    Counter, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+)
+
+# с несколькими воркерами gunicorn метрики собираются через файлы в PROMETHEUS_MULTIPROC_DIR
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['route', 'method', 'status']
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Response body size by route',
+    ['route'], buckets=SIZE_BUCKETS
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'Postgres statements executed per request',
+    ['route'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+DB_TIME_PER_REQUEST = Histogram(
+    'db_time_per_request_seconds', 'Time spent in Postgres per request',
+    ['route'], buckets=FAST_BUCKETS
+)
+DB_QUERY_LATENCY = Histogram('db_query_duration_seconds', 'Postgres statement latency', buckets=FAST_BUCKETS)
+DB_POOL_WAIT = Histogram('db_pool_wait_seconds', 'Wait for a pooled connection', buckets=FAST_BUCKETS)
+REDIS_LATENCY = Histogram(
+    'redis_command_duration_seconds', 'Redis command or pipeline latency',
+    ['command'], buckets=FAST_BUCKETS
+)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by result', ['cache', 'result'])
+
+# счетчики текущего запроса; фоновые потоки сюда не пишут
+_local = threading.local()
+
+
+def start_request():
+    _local.start = time.perf_counter()
+    _local.db_count = 0
+    _local.db_time = 0.0
+
+
+def finish_request(route, method, status, size):
+    start = getattr(_local, 'start', None)
+    if start is None:
+        return
+    _local.start = None
+    REQUEST_LATENCY.labels(route, method, status).observe(time.perf_counter() - start)
+    DB_QUERIES_PER_REQUEST.labels(route).observe(_local.db_count)
+    DB_TIME_PER_REQUEST.labels(route).observe(_local.db_time)
+    if size is not None:
+        RESPONSE_SIZE.labels(route).observe(size)
+
+
+def observe_db(duration):
+    DB_QUERY_LATENCY.observe(duration)
+    if getattr(_local, 'start', None) is not None:
+        _local.db_count += 1
+        _local.db_time += duration
+
+
+def observe_redis(command, duration):
+    REDIS_LATENCY.labels(command).observe(duration)
+
+
+def count_cache(cache, result):
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def render_metrics():
+    """Prometheus text exposition as (body, content type)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -1,44 +1,165 @@
+import os
+import sys
 import json
 import time
-from redis_config import get_pubsub
+import socket
+from redis_config import (
+    redis_client, get_pubsub, ensure_consumer_group, get_notification_lag,
+    notification_stream_key, NOTIFICATION_CHANNELS
+)
+
+NOTIFICATION_GROUP = os.getenv('NOTIFICATION_GROUP', 'notifications')
+# имя потребителя должно быть уникальным внутри группы
+NOTIFICATION_CONSUMER = os.getenv('NOTIFICATION_CONSUMER', f"{socket.gethostname()}-{os.getpid()}")
+NOTIFICATION_BATCH = int(os.getenv('NOTIFICATION_BATCH', 100))
+# меньше socket_timeout клиента Redis (5 секунд)
+NOTIFICATION_BLOCK_MS = int(os.getenv('NOTIFICATION_BLOCK_MS', 2000))
+# сообщения упавшего потребителя забираем после этой паузы
+NOTIFICATION_CLAIM_IDLE_MS = int(os.getenv('NOTIFICATION_CLAIM_IDLE_MS', 60000))
+NOTIFICATION_LAG_INTERVAL = float(os.getenv('NOTIFICATION_LAG_INTERVAL', 30))
+
+
+def handle_notification(channel, data):
+    print(f"\nNew notification on channel '{channel}':")
+    print(f"Type: {data.get('type')}")
+
+    if data.get('type') == 'new_artwork':
+        print(f"New artwork added: {data.get('title')} (ID: {data.get('artwork_id')})")
+        print(f"Price: ${data.get('price')}")
+
+    elif data.get('type') == 'artworks_imported':
+        print(f"Catalog import: {data.get('inserted')} added, {data.get('updated')} updated")
+
+    elif data.get('type') == 'new_review':
+        print(f"New review for artwork {data.get('artwork_id')}")
+        print(f"Rating: {data.get('rating')}/5")
+
+    elif data.get('type') == 'new_order':
+        print(f"New order created (ID: {data.get('order_id')})")
+        for item in data.get('items', []):
+            print(f"Artwork ID: {item.get('artwork_id')} x {item.get('quantity')}")
+
 
 def listen_for_notifications():
+    # режим PubSub: только пока клиент подключен, пропущенные сообщения теряются
     pubsub = get_pubsub()
-    
+
     # подписываемся на все каналы
-    pubsub.subscribe('artworks', 'artwork_reviews', 'orders')
-    
+    pubsub.subscribe(*NOTIFICATION_CHANNELS)
+
     print("Listening for notifications...")
-    
+
     while True:
-        message = pubsub.get_message()
-        if message and message['type'] == 'message':
-            try:
-                data = json.loads(message['data'])
-                channel = message['channel']
-                
-                print(f"\nNew notification on channel '{channel}':")
-                print(f"Type: {data.get('type')}")
-                
-                if data.get('type') == 'new_artwork':
-                    print(f"New artwork added: {data.get('title')} (ID: {data.get('artwork_id')})")
-                    print(f"Price: ${data.get('price')}")
-                
-                elif data.get('type') == 'new_review':
-                    print(f"New review for artwork {data.get('artwork_id')}")
-                    print(f"Rating: {data.get('rating')}/5")
-                
-                elif data.get('type') == 'new_order':
-                    print(f"New order created (ID: {data.get('order_id')})")
-                    print(f"Artwork ID: {data.get('artwork_id')}")
-                    print(f"Quantity: {data.get('quantity')}")
-                
-            except json.JSONDecodeError:
-                print("Error decoding message")
-            except Exception as e:
-                print(f"Error processing message: {str(e)}")
-        
-        time.sleep(0.1)
+        # ждем сообщение в select, без опроса в цикле со sleep
+        message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+        if not message:
+            continue
+        try:
+            handle_notification(message['channel'], json.loads(message['data']))
+        except json.JSONDecodeError:
+            print("Error decoding message")
+        except Exception as e:
+            print(f"Error processing message: {str(e)}")
+
+
+def process_entries(stream, entries):
+    """Handle a batch of stream entries. Returns ids that can be acknowledged."""
+    channel = stream.split(':', 1)[1]
+    done = []
+    for entry_id, fields in entries:
+        if not fields:
+            # запись уже вытеснена MAXLEN, подтверждаем, чтобы не висела в pending
+            done.append(entry_id)
+            continue
+        try:
+            handle_notification(channel, json.loads(fields['data']))
+            done.append(entry_id)
+        except (json.JSONDecodeError, KeyError):
+            # повтор не поможет
+            print(f"Error decoding message {entry_id}")
+            done.append(entry_id)
+        except Exception as e:
+            # не подтверждаем - сообщение будет доставлено повторно
+            print(f"Error processing message {entry_id}: {str(e)}")
+    return done
+
+
+def ack(acks):
+    # подтверждение пачкой, одним запросом на все потоки
+    if not acks:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for stream, ids in acks.items():
+        if ids:
+            pipe.xack(stream, NOTIFICATION_GROUP, *ids)
+    pipe.execute()
+
+
+def claim_stale():
+    # сообщения, которые взял и не подтвердил другой (упавший) потребитель
+    acks = {}
+    for channel in NOTIFICATION_CHANNELS:
+        stream = notification_stream_key(channel)
+        result = redis_client.xautoclaim(
+            stream, NOTIFICATION_GROUP, NOTIFICATION_CONSUMER,
+            min_idle_time=NOTIFICATION_CLAIM_IDLE_MS, start_id='0-0', count=NOTIFICATION_BATCH
+        )
+        acks[stream] = process_entries(stream, result[1])
+    ack(acks)
+
+
+def report_lag():
+    for channel, info in get_notification_lag().items():
+        group = info['groups'].get(NOTIFICATION_GROUP)
+        if group:
+            print(f"[lag] {channel}: lag={group['lag']} pending={group['pending']} consumers={group['consumers']}")
+
+
+def drain_pending(streams):
+    # после перезапуска сначала свои неподтвержденные сообщения
+    for stream in streams:
+        last_id = '0'
+        while True:
+            response = redis_client.xreadgroup(
+                NOTIFICATION_GROUP, NOTIFICATION_CONSUMER, {stream: last_id}, count=NOTIFICATION_BATCH
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                break
+            ack({stream: process_entries(stream, entries)})
+            last_id = entries[-1][0]
+
+
+def consume_notifications():
+    """At-least-once consumer: XREADGROUP with blocking reads, batch XACK, reclaim of stale entries."""
+    ensure_consumer_group(NOTIFICATION_GROUP)
+    streams = [notification_stream_key(channel) for channel in NOTIFICATION_CHANNELS]
+    print(f"Consuming notifications as '{NOTIFICATION_CONSUMER}' in group '{NOTIFICATION_GROUP}'...")
+    drain_pending(streams)
+
+    last_maintenance = time.monotonic()
+    while True:
+        try:
+            if time.monotonic() - last_maintenance > NOTIFICATION_LAG_INTERVAL:
+                claim_stale()
+                report_lag()
+                last_maintenance = time.monotonic()
+
+            # блокирующее чтение: ждем события на сервере, а не опрашиваем
+            response = redis_client.xreadgroup(
+                NOTIFICATION_GROUP, NOTIFICATION_CONSUMER, {stream: '>' for stream in streams},
+                count=NOTIFICATION_BATCH, block=NOTIFICATION_BLOCK_MS
+            )
+            ack({stream: process_entries(stream, entries) for stream, entries in response or []})
+        except Exception as e:
+            print(f"Error consuming notifications: {str(e)}")
+            time.sleep(1)
+
 
 if __name__ == '__main__':
-    listen_for_notifications() 
\ No newline at end of file
+    # python notification_client.py [stream|pubsub]
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'stream'
+    if mode == 'pubsub':
+        listen_for_notifications()
+    else:
+        consume_notifications()
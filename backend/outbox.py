@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import queue
+import threading
+from db_config import db_connection
+from redis_config import publish_notifications, increment_stats, get_stats
+
+OUTBOX_QUEUE_SIZE = int(os.getenv('OUTBOX_QUEUE_SIZE', 10000))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_RETRIES = int(os.getenv('OUTBOX_MAX_RETRIES', 5))
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', 10))
+# 1 - события пишутся в таблицу notification_outbox в транзакции запроса и не теряются без Redis
+OUTBOX_TABLE = os.getenv('OUTBOX_TABLE', '0') == '1'
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))
+
+_queue = queue.Queue(maxsize=OUTBOX_QUEUE_SIZE)
+_wake = threading.Event()
+_start_lock = threading.Lock()
+_threads = []
+
+# счетчики лежат в Redis: /admin/outbox видит сумму по всем воркерам
+STATS_DEFAULTS = {
+    'queued': 0,
+    'published': 0,
+    'batches': 0,
+    'failed_attempts': 0,
+    'dropped': 0,
+    'relayed': 0
+}
+
+# до отправки в Redis счетчики копятся здесь: запросы не ходят в Redis,
+# а сбои публикации, пока Redis лежит, не теряются
+_pending_lock = threading.Lock()
+_pending = {}
+
+
+def _count(name, value=1):
+    with _pending_lock:
+        _pending[name] = _pending.get(name, 0) + value
+
+
+def _flush_stats():
+    with _pending_lock:
+        counts = dict(_pending)
+        _pending.clear()
+    if not increment_stats('outbox', counts):
+        with _pending_lock:
+            for name, value in counts.items():
+                _pending[name] = _pending.get(name, 0) + value
+
+
+def get_outbox_stats():
+    _flush_stats()
+    stats = get_stats('outbox', STATS_DEFAULTS)
+    # очередь в памяти своя у каждого воркера: это размер очереди ответившего процесса
+    stats['queue_size'] = _queue.qsize()
+    stats['table_mode'] = OUTBOX_TABLE
+    return stats
+
+
+def _backoff(attempt):
+    time.sleep(min(0.1 * (2 ** attempt), OUTBOX_BACKOFF_MAX))
+
+
+def _publish_with_retry(batch):
+    for attempt in range(OUTBOX_MAX_RETRIES + 1):
+        try:
+            publish_notifications(batch)
+            _count('published', len(batch))
+            _count('batches')
+            return
+        except Exception as e:
+            _count('failed_attempts')
+            print(f"Error publishing outbox batch (attempt {attempt + 1}): {str(e)}")
+            if attempt < OUTBOX_MAX_RETRIES:
+                _backoff(attempt)
+    _count('dropped', len(batch))
+
+
+def _publisher_loop():
+    while True:
+        # первое событие ждем блокирующе, остальные добираем без ожидания
+        batch = [_queue.get()]
+        while len(batch) < OUTBOX_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        _publish_with_retry(batch)
+        _flush_stats()
+
+
+def relay_outbox_batch():
+    """Publish one batch from notification_outbox and delete it. Returns rows relayed."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # несколько воркеров разбирают таблицу параллельно, не мешая друг другу
+            cur.execute("""
+                SELECT id, channel, payload FROM notification_outbox
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED;
+            """, (OUTBOX_BATCH_SIZE,))
+            rows = cur.fetchall()
+            if rows:
+                publish_notifications([(channel, payload) for _, channel, payload in rows])
+                cur.execute("DELETE FROM notification_outbox WHERE id = ANY(%s);", ([row[0] for row in rows],))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    _count('relayed', len(rows))
+    return len(rows)
+
+
+def _relay_loop():
+    attempt = 0
+    while True:
+        _wake.wait(OUTBOX_POLL_INTERVAL)
+        _wake.clear()
+        try:
+            while relay_outbox_batch() == OUTBOX_BATCH_SIZE:
+                pass
+            attempt = 0
+        except Exception as e:
+            # строки остались в таблице, повторим позже
+            _count('failed_attempts')
+            print(f"Error relaying outbox: {str(e)}")
+            _backoff(attempt)
+            attempt = min(attempt + 1, OUTBOX_MAX_RETRIES)
+        _flush_stats()
+
+
+def start_outbox():
+    # потоки запускаются в каждом процессе после fork
+    with _start_lock:
+        if _threads:
+            return
+        # очередь в памяти нужна и в режиме таблицы - как запасной путь
+        targets = [_publisher_loop] + ([_relay_loop] if OUTBOX_TABLE else [])
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True, name=f"outbox{target.__name__}")
+            thread.start()
+            _threads.append(thread)
+
+
+def stage_notification(cur, channel, message):
+    """In table mode write the event in the caller's transaction. Returns True if staged."""
+    if not OUTBOX_TABLE:
+        return False
+    cur.execute(
+        "INSERT INTO notification_outbox (channel, payload) VALUES (%s, %s::jsonb);",
+        (channel, json.dumps(message))
+    )
+    return True
+
+
+def send_notification(channel, message, staged=False):
+    """Call after commit. Never touches Redis on the request path."""
+    start_outbox()
+    if staged:
+        _wake.set()
+        return
+    if OUTBOX_TABLE:
+        # событие без транзакции (например, из процедуры резервирования) тоже через таблицу
+        try:
+            with db_connection() as conn:
+                cur = conn.cursor()
+                stage_notification(cur, channel, message)
+                conn.commit()
+                cur.close()
+            _wake.set()
+            return
+        except Exception as e:
+            print(f"Error writing outbox row: {str(e)}")
+    try:
+        _queue.put_nowait((channel, message))
+        _count('queued')
+    except queue.Full:
+        _count('dropped')
+        print(f"Outbox queue is full, dropping notification for '{channel}'")
+
+
+def flush_outbox(timeout=5):
+    # при остановке воркера даем очереди разойтись
+    deadline = time.monotonic() + timeout
+    while not _queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    _flush_stats()
@@ -0,0 +1,72 @@
+import os
+import time
+import uuid
+from redis_config import redis_client
+
+# лимиты: (количество запросов, окно в секундах)
+RATE_LIMITS = {
+    'login:ip': (int(os.getenv('LOGIN_RATE_LIMIT_IP', 20)), 60),
+    'login:username': (int(os.getenv('LOGIN_RATE_LIMIT_USERNAME', 10)), 60),
+    'register:ip': (int(os.getenv('REGISTER_RATE_LIMIT_IP', 5)), 60),
+    'add_artwork:user': (int(os.getenv('ADD_ARTWORK_RATE_LIMIT_USER', 30)), 60),
+}
+
+
+# проверка и запись одной командой: отклоненные попытки не записываются, иначе ZSET
+# заблокированного ключа рос бы без предела, пока его долбят
+_HIT_SCRIPT = redis_client.register_script("""
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return tostring(math.max(tonumber(oldest[2]) + window - now, 0.001))
+end
+if ARGV[5] == '1' then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(window) + 1)
+end
+return '0'
+""")
+
+
+def hit(key, limit, window, record=True):
+    """Sliding-window log in a sorted set. Returns seconds to wait, 0 if allowed; record=False only checks."""
+    now = time.time()
+    # число из Lua вернулось бы целым, поэтому строка
+    return float(_HIT_SCRIPT(
+        keys=[f"ratelimit:{key}"],
+        args=[now, window, limit, f"{now}:{uuid.uuid4().hex[:8]}", 1 if record else 0]
+    ))
+
+
+def _rules(action, identifiers):
+    for name, value in identifiers.items():
+        rule = f"{action}:{name}"
+        if value is not None and rule in RATE_LIMITS:
+            yield f"{rule}:{value}", RATE_LIMITS[rule]
+
+
+def check_rate_limits(action, record=True, **identifiers):
+    """Check (and with record=True count) one request for every identifier (ip=..., username=...). Returns max wait in seconds."""
+    retry_after = 0
+    for key, (limit, window) in _rules(action, identifiers):
+        try:
+            retry_after = max(retry_after, hit(key, limit, window, record))
+        except Exception as e:
+            # Redis недоступен - не блокируем пользователей
+            print(f"Rate limiter error: {str(e)}")
+    return retry_after
+
+
+def record_attempt(action, **identifiers):
+    """Count an attempt without checking, e.g. a failed login after the check passed."""
+    now = time.time()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for key, (_, window) in _rules(action, identifiers):
+            pipe.zadd(f"ratelimit:{key}", {f"{now}:{uuid.uuid4().hex[:8]}": now})
+            pipe.expire(f"ratelimit:{key}", int(window) + 1)
+        pipe.execute()
+    except Exception as e:
+        print(f"Rate limiter error: {str(e)}")
@@ -1,14 +1,47 @@
 import os
 import redis
 import json
+import math
+import time
+import random
+import hashlib
+from metrics import observe_redis
+from json_codec import dumps, loads
 from datetime import timedelta
 
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 
+
+class TimedRedis(redis.Redis):
+    """Redis client that reports command and pipeline latency to the metrics module."""
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]).upper(), time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction=transaction, shard_hint=shard_hint)
+        execute = pipe.execute
+
+        # команды в pipeline буферизуются, по сети идет только execute
+        def timed_execute(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                observe_redis('PIPELINE', time.perf_counter() - start)
+
+        pipe.execute = timed_execute
+        return pipe
+
+
 # Создаем Redis 
 try:
-    redis_client = redis.Redis(
+    redis_client = TimedRedis(
         host=REDIS_HOST,
         port=REDIS_PORT,
         decode_responses=True, 
@@ -29,11 +62,25 @@ except Exception as e:
 # Token on
 TOKEN_EXPIRY = timedelta(hours=24)  
 CACHE_EXPIRY = timedelta(minutes=30) 
+# мягкий срок кэша: после него данные еще отдаются, а один воркер пересобирает кэш в фоне
+CACHE_SOFT_TTL = int(os.getenv('CACHE_SOFT_TTL', CACHE_EXPIRY.total_seconds() * 2 / 3))
+# чем больше, тем раньше начинается вероятностное обновление
+CACHE_EARLY_BETA = float(os.getenv('CACHE_EARLY_BETA', 1.0))
+
+def _token_index_key(token):
+    # в ключ кладем хэш, а не сам токен
+    return f"token:{hashlib.sha256(token.encode()).hexdigest()}"
 
 def store_token(user_id, token):
     try:
         key = f"user_token:{user_id}"
-        redis_client.setex(key, TOKEN_EXPIRY, token)
+        old_token = redis_client.get(key)
+        pipe = redis_client.pipeline()
+        if old_token:
+            pipe.delete(_token_index_key(old_token))
+        pipe.setex(key, TOKEN_EXPIRY, token)
+        pipe.setex(_token_index_key(token), TOKEN_EXPIRY, user_id)
+        pipe.execute()
         return token
     except Exception as e:
         print(f"Error storing token: {str(e)}")
@@ -47,10 +94,23 @@ def get_token(user_id):
         print(f"Error getting token: {str(e)}")
         return None
 
+def get_user_id_by_token(token):
+    # обратный индекс token -> user_id, один GET вместо SCAN
+    try:
+        return redis_client.get(_token_index_key(token))
+    except Exception as e:
+        print(f"Error getting user by token: {str(e)}")
+        return None
+
 def delete_token(user_id):
     try:
         key = f"user_token:{user_id}"
-        redis_client.delete(key)
+        token = redis_client.get(key)
+        pipe = redis_client.pipeline()
+        if token:
+            pipe.delete(_token_index_key(token))
+        pipe.delete(key)
+        pipe.execute()
     except Exception as e:
         print(f"Error deleting token: {str(e)}")
         raise
@@ -73,6 +133,26 @@ def get_session_data(user_id):
         print(f"Error getting session data: {str(e)}")
         return None
 
+def get_session_role(user_id):
+    # роль записывается в сессию при входе, проверка прав обходится без базы
+    try:
+        return redis_client.hget(f"session:{user_id}", 'role')
+    except Exception as e:
+        print(f"Error getting session role: {str(e)}")
+        return None
+
+def set_session_role(user_id, role):
+    try:
+        key = f"session:{user_id}"
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hset(key, 'role', role)
+        pipe.expire(key, TOKEN_EXPIRY)
+        pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Error setting session role: {str(e)}")
+        return False
+
 def delete_session_data(user_id):
     try:
         key = f"session:{user_id}"
@@ -81,75 +161,519 @@ def delete_session_data(user_id):
         print(f"Error deleting session data: {str(e)}")
         raise
 
-# кэш для артикулов
-def cache_artworks(artworks):
+def _cache_meta(rebuild_time):
+    # delta - сколько заняла пересборка, от нее зависит раннее обновление
+    return json.dumps({'soft': time.time() + CACHE_SOFT_TTL, 'delta': rebuild_time})
+
+# метка сброшенного кэша: данные еще отдаются, но первый же читатель запускает пересборку
+STALE_CACHE_META = json.dumps({'soft': 0, 'delta': 0})
+
+def _is_stale(meta):
     try:
-        key = "artworks:all"
-        redis_client.setex(key, CACHE_EXPIRY, json.dumps(artworks))
+        return json.loads(meta)['soft'] == 0
+    except (TypeError, ValueError, KeyError):
+        return False
+
+def _needs_refresh(meta):
+    """Probabilistic early expiration: refresh more likely the closer to the soft TTL."""
+    try:
+        meta = json.loads(meta)
+        soft, delta = meta['soft'], max(meta['delta'], 0.001)
+    except (TypeError, ValueError, KeyError):
+        return True
+    return time.time() - delta * CACHE_EARLY_BETA * math.log(1 - random.random()) >= soft
+
+# версии ресурсов для ETag: меняются при изменении данных (запись, инвалидация), но не при заполнении кэша
+ARTWORKS_VERSION_KEY = "version:artworks"
+VERSION_EXPIRY = 7 * 24 * 3600
+
+def _reviews_version_key(artwork_id):
+    return f"version:reviews:{artwork_id}"
+
+def _bump_version_in_pipe(pipe, key):
+    # после потери ключа начинаем не с 1, а с текущего времени, чтобы не повторить старую версию
+    pipe.set(key, time.time_ns(), nx=True, ex=VERSION_EXPIRY)
+    pipe.incr(key)
+    pipe.expire(key, VERSION_EXPIRY)
+
+def _get_version(key):
+    try:
+        version = redis_client.get(key)
+        if version is None:
+            redis_client.set(key, time.time_ns(), nx=True, ex=VERSION_EXPIRY)
+            version = redis_client.get(key)
+        return version
+    except Exception as e:
+        print(f"Error getting version {key}: {str(e)}")
+        return None
+
+def get_artworks_version():
+    return _get_version(ARTWORKS_VERSION_KEY)
+
+def get_reviews_version(artwork_id):
+    return _get_version(_reviews_version_key(artwork_id))
+
+def bump_artworks_version():
+    # для изменений, которые не проходят через функции кэша
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error bumping artworks version: {str(e)}")
+
+# кэш для артикулов: по ключу на каждый артикул + отсортированные индексы
+ARTWORKS_INDEX_KEY = "artworks:index"
+ARTWORKS_READY_KEY = "artworks:index:ready"
+# множество ключей индексов по категориям, чтобы не искать их через SCAN
+ARTWORKS_CATEGORIES_KEY = "artworks:index:categories"
+# сколько артикулов уходит в Redis за один запрос при полной пересборке
+CACHE_WRITE_CHUNK = int(os.getenv('CACHE_WRITE_CHUNK', 1000))
+
+def _artwork_key(artwork_id):
+    return f"artwork:{artwork_id}"
+
+def _category_index_key(category):
+    return f"artworks:index:category:{category}"
+
+def _add_artwork_to_pipe(pipe, artwork):
+    artwork_id = artwork['id']
+    pipe.setex(_artwork_key(artwork_id), CACHE_EXPIRY, dumps(artwork))
+    pipe.zadd(ARTWORKS_INDEX_KEY, {artwork_id: artwork_id})
+    pipe.expire(ARTWORKS_INDEX_KEY, CACHE_EXPIRY)
+    if artwork.get('category') is not None:
+        category_key = _category_index_key(artwork['category'])
+        pipe.zadd(category_key, {artwork_id: artwork_id})
+        pipe.expire(category_key, CACHE_EXPIRY)
+        pipe.sadd(ARTWORKS_CATEGORIES_KEY, category_key)
+        pipe.expire(ARTWORKS_CATEGORIES_KEY, CACHE_EXPIRY)
+
+def cache_artworks(artworks, rebuild_time=0, version=None):
+    """Replace the whole catalog. version is the artworks version read before loading artworks from the database."""
+    # полная пересборка: артикулы и новые индексы пишем частями, без длинной транзакции,
+    # затем одной короткой транзакцией подменяем индексы через RENAME
+    try:
+        build = f"artworks:build:{random.getrandbits(64):x}"
+        build_keys = {}
+        for start in range(0, len(artworks), CACHE_WRITE_CHUNK):
+            pipe = redis_client.pipeline(transaction=False)
+            for artwork in artworks[start:start + CACHE_WRITE_CHUNK]:
+                artwork_id = artwork['id']
+                pipe.setex(_artwork_key(artwork_id), CACHE_EXPIRY, dumps(artwork))
+                index_keys = [ARTWORKS_INDEX_KEY]
+                if artwork.get('category') is not None:
+                    index_keys.append(_category_index_key(artwork['category']))
+                for index_key in index_keys:
+                    build_key = build_keys.setdefault(index_key, f"{build}:{index_key}")
+                    pipe.zadd(build_key, {artwork_id: artwork_id})
+            # временные индексы не переживут упавшую пересборку
+            for build_key in build_keys.values():
+                pipe.expire(build_key, CACHE_EXPIRY)
+            pipe.execute()
+
+        new_category_keys = [key for key in build_keys if key != ARTWORKS_INDEX_KEY]
+
+        def swap(pipe):
+            ready = pipe.get(ARTWORKS_READY_KEY)
+            old_category_keys = pipe.smembers(ARTWORKS_CATEGORIES_KEY)
+            # запись прошла после чтения из базы: в снимке ее может не быть
+            raced = version is not None and pipe.get(ARTWORKS_VERSION_KEY) != version
+            pipe.multi()
+            pipe.delete(ARTWORKS_INDEX_KEY, ARTWORKS_CATEGORIES_KEY, *old_category_keys)
+            for index_key, build_key in build_keys.items():
+                pipe.rename(build_key, index_key)
+                pipe.expire(index_key, CACHE_EXPIRY)
+            if new_category_keys:
+                pipe.sadd(ARTWORKS_CATEGORIES_KEY, *new_category_keys)
+                pipe.expire(ARTWORKS_CATEGORIES_KEY, CACHE_EXPIRY)
+            # после гонки снимок сразу помечаем устаревшим, следующий читатель пересоберет его еще раз
+            pipe.setex(ARTWORKS_READY_KEY, CACHE_EXPIRY, STALE_CACHE_META if raced else _cache_meta(rebuild_time))
+            # сброшенный каталог отдавался под уже новой версией, а гонка подменяет чужую запись:
+            # тело меняется, значит меняется и ETag. Обычная пересборка кладет те же данные, версию не трогаем
+            if raced or _is_stale(ready):
+                _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+
+        redis_client.transaction(swap, ARTWORKS_READY_KEY, ARTWORKS_CATEGORIES_KEY, ARTWORKS_VERSION_KEY)
         return True
     except Exception as e:
         print(f"Error caching artworks: {str(e)}")
         raise
 
-def get_cached_artworks():
+def get_cached_artworks(offset=0, limit=None, category=None, after_id=None):
+    """Page from the cache as (items, needs_refresh); items are the stored JSON strings, None on a miss."""
+    # страница каталога: ZRANGE по индексу, затем один MGET
     try:
-        key = "artworks:all"
-        data = redis_client.get(key)
-        return json.loads(data) if data else None
-    except json.JSONDecodeError as e:
-        print(f"Error decoding cached artworks: {str(e)}")
-        return None
+        index_key = _category_index_key(category) if category else ARTWORKS_INDEX_KEY
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(ARTWORKS_READY_KEY)
+        if after_id is not None:
+            # keyset: score = id, берем всё строго после курсора
+            pipe.zrangebyscore(index_key, f"({after_id}", "+inf", start=offset, num=-1 if limit is None else limit)
+        else:
+            stop = -1 if limit is None else offset + limit - 1
+            pipe.zrange(index_key, offset, stop)
+        ready, ids = pipe.execute()
+        if not ready:
+            return None, True
+        refresh = _needs_refresh(ready)
+        if not ids:
+            return [], refresh
+        data = redis_client.mget([_artwork_key(artwork_id) for artwork_id in ids])
+        if any(item is None for item in data):
+            # часть элементов истекла, считаем промахом
+            return None, True
+        # строки отдаются клиенту как есть, без json.loads
+        return data, refresh
     except Exception as e:
         print(f"Error getting cached artworks: {str(e)}")
+        return None, False
+
+def cache_artwork(artwork):
+    # обновляем только один артикул и его записи в индексах
+    try:
+        # WATCH: если ключ поменяли между чтением и записью, transaction() повторит попытку
+        def update(pipe):
+            old = pipe.get(_artwork_key(artwork['id']))
+            pipe.multi()
+            if old:
+                old_category = loads(old).get('category')
+                if old_category is not None and old_category != artwork.get('category'):
+                    pipe.zrem(_category_index_key(old_category), artwork['id'])
+            _add_artwork_to_pipe(pipe, artwork)
+            _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+
+        redis_client.transaction(update, _artwork_key(artwork['id']))
+        return True
+    except Exception as e:
+        print(f"Error caching artwork: {str(e)}")
+        raise
+
+def update_cached_artwork_stock(artwork_id, stock):
+    key = _artwork_key(artwork_id)
+    try:
+        # чтение-изменение-запись под WATCH: параллельное обновление рейтинга не затирается
+        def update(pipe):
+            data = pipe.get(key)
+            pipe.multi()
+            # остаток в базе изменился, даже если артикула нет в кэше
+            _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+            if data:
+                artwork = loads(data)
+                artwork['stock'] = stock
+                pipe.setex(key, CACHE_EXPIRY, dumps(artwork))
+            return bool(data)
+
+        return redis_client.transaction(update, key, value_from_callable=True)
+    except Exception as e:
+        print(f"Error updating cached artwork stock: {str(e)}")
+        raise
+
+def uncache_artwork(artwork_id):
+    try:
+        old = redis_client.get(_artwork_key(artwork_id))
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(_artwork_key(artwork_id))
+        pipe.zrem(ARTWORKS_INDEX_KEY, artwork_id)
+        if old:
+            category = loads(old).get('category')
+            if category is not None:
+                pipe.zrem(_category_index_key(category), artwork_id)
+        _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error removing cached artwork: {str(e)}")
+        raise
+
+# снимаем замок, только если он все еще наш: по истечении TTL его мог взять другой воркер
+_RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+def acquire_lock(name, ttl=30):
+    """SET NX EX lock so only one worker does the heavy work. Returns the owner token or None."""
+    try:
+        token = f"{random.getrandbits(64):x}"
+        if redis_client.set(f"lock:{name}", token, nx=True, ex=ttl):
+            return token
+        return None
+    except Exception as e:
+        print(f"Error acquiring lock {name}: {str(e)}")
         return None
 
+def is_locked(name):
+    try:
+        return bool(redis_client.exists(f"lock:{name}"))
+    except Exception as e:
+        print(f"Error checking lock {name}: {str(e)}")
+        return False
+
+def wait_for_lock(name, timeout):
+    # ждем, пока другой воркер закончит работу под замком; True - замок снят
+    deadline = time.monotonic() + timeout
+    try:
+        while redis_client.exists(f"lock:{name}"):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.02)
+        return True
+    except Exception as e:
+        print(f"Error waiting for lock {name}: {str(e)}")
+        return False
+
+def release_lock(name, token):
+    try:
+        _RELEASE_LOCK_SCRIPT(keys=[f"lock:{name}"], args=[token])
+    except Exception as e:
+        print(f"Error releasing lock {name}: {str(e)}")
+
 def invalidate_artworks_cache():
     try:
-        key = "artworks:all"
-        redis_client.delete(key)
+        # данные не удаляем: до пересборки их еще отдают, но первый же читатель запустит пересборку
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.set(ARTWORKS_READY_KEY, STALE_CACHE_META, xx=True, keepttl=True)
+        _bump_version_in_pipe(pipe, ARTWORKS_VERSION_KEY)
+        pipe.execute()
     except Exception as e:
         print(f"Error invalidating artworks cache: {str(e)}")
         raise
 
-# кэш для отзывов
-def cache_artwork_reviews(artwork_id, reviews):
+# кэш для отзывов: список последних REVIEWS_CACHE_SIZE отзывов, новые сверху
+REVIEWS_CACHE_SIZE = int(os.getenv('REVIEWS_CACHE_SIZE', 50))
+
+def _reviews_key(artwork_id):
+    return f"reviews:artwork:{artwork_id}"
+
+def _reviews_loaded_key(artwork_id):
+    # "1" - в списке все отзывы, "0" - только первые REVIEWS_CACHE_SIZE
+    return f"reviews:artwork:{artwork_id}:loaded"
+
+def _reviews_meta_key(artwork_id):
+    return f"reviews:artwork:{artwork_id}:meta"
+
+def cache_artwork_reviews(artwork_id, reviews, complete, rebuild_time=0, version=None):
+    """Replace the cached list. With version (read before loading reviews), skip if a review was added meanwhile."""
     try:
-        key = f"reviews:artwork:{artwork_id}"
-        redis_client.setex(key, CACHE_EXPIRY, json.dumps(reviews))
-        return True
+        key = _reviews_key(artwork_id)
+        version_key = _reviews_version_key(artwork_id)
+
+        def update(pipe):
+            # отзыв, добавленный после чтения из базы, не должен пропасть при перезаписи списка
+            if version is not None and pipe.get(version_key) != version:
+                return False
+            pipe.multi()
+            pipe.delete(key)
+            if reviews:
+                pipe.rpush(key, *[dumps(review) for review in reviews[:REVIEWS_CACHE_SIZE]])
+                pipe.expire(key, CACHE_EXPIRY)
+            pipe.setex(_reviews_loaded_key(artwork_id), CACHE_EXPIRY, 1 if complete else 0)
+            pipe.setex(_reviews_meta_key(artwork_id), CACHE_EXPIRY, _cache_meta(rebuild_time))
+            return True
+
+        return redis_client.transaction(update, version_key, value_from_callable=True)
     except Exception as e:
         print(f"Error caching artwork reviews: {str(e)}")
         raise
 
-def get_cached_artwork_reviews(artwork_id):
+def _review_position(item):
+    review = loads(item)
+    return review['review_date'], review['id']
+
+def get_cached_artwork_reviews(artwork_id, limit, after=None):
+    """Reviews older than after=(review_date, id) as (items, needs_refresh); items are the stored JSON strings, None if the cache can't answer."""
     try:
-        key = f"reviews:artwork:{artwork_id}"
-        data = redis_client.get(key)
-        return json.loads(data) if data else None
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(_reviews_loaded_key(artwork_id))
+        pipe.get(_reviews_meta_key(artwork_id))
+        pipe.lrange(_reviews_key(artwork_id), 0, -1)
+        loaded, meta, items = pipe.execute()
+        if loaded is None:
+            return None, True
+        refresh = _needs_refresh(meta)
+        if after is not None:
+            # список упорядочен от новых к старым: разбираем только до позиции курсора
+            start = next((i for i, item in enumerate(items) if _review_position(item) < after), len(items))
+            items = items[start:]
+        if len(items) >= limit or loaded == '1':
+            return items[:limit], refresh
+        # страница выходит за пределы закэшированного списка
+        return None, refresh
     except json.JSONDecodeError as e:
         print(f"Error decoding cached reviews: {str(e)}")
-        return None
+        return None, True
     except Exception as e:
         print(f"Error getting cached reviews: {str(e)}")
-        return None
+        return None, False
+
+def prepend_artwork_review(artwork_id, review):
+    # новый отзыв добавляем в начало списка вместо сброса кэша
+    key = _reviews_key(artwork_id)
+    loaded_key = _reviews_loaded_key(artwork_id)
+    try:
+        # проверка и запись под WATCH: параллельная перезагрузка списка не смешается с добавлением
+        def update(pipe):
+            loaded = pipe.get(loaded_key)
+            length = pipe.llen(key)
+            pipe.multi()
+            _bump_version_in_pipe(pipe, _reviews_version_key(artwork_id))
+            if loaded is None:
+                return False
+            pipe.lpush(key, dumps(review))
+            pipe.ltrim(key, 0, REVIEWS_CACHE_SIZE - 1)
+            pipe.expire(key, CACHE_EXPIRY)
+            if length >= REVIEWS_CACHE_SIZE and loaded == '1':
+                # самый старый отзыв вытеснен, список больше не полный
+                pipe.setex(loaded_key, CACHE_EXPIRY, 0)
+            return True
+
+        return redis_client.transaction(update, loaded_key, key, value_from_callable=True)
+    except Exception as e:
+        print(f"Error prepending artwork review: {str(e)}")
+        raise
+
+def bump_reviews_version(artwork_id):
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        _bump_version_in_pipe(pipe, _reviews_version_key(artwork_id))
+        pipe.execute()
+    except Exception as e:
+        print(f"Error bumping reviews version: {str(e)}")
 
 def invalidate_artwork_reviews_cache(artwork_id):
     try:
-        key = f"reviews:artwork:{artwork_id}"
-        redis_client.delete(key)
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(_reviews_loaded_key(artwork_id), _reviews_meta_key(artwork_id), _reviews_key(artwork_id))
+        _bump_version_in_pipe(pipe, _reviews_version_key(artwork_id))
+        pipe.execute()
     except Exception as e:
         print(f"Error invalidating reviews cache: {str(e)}")
         raise
 
-# PubSub для уведомлений
-def publish_notification(channel, message):
+# служебные счетчики в Redis: общие для всех воркеров gunicorn и отдельных процессов
+def _stats_key(name):
+    return f"stats:{name}"
+
+def increment_stats(name, counts):
+    """Add {field: number} to the shared stats hash in one round trip. Returns False on a Redis error (only logged)."""
+    counts = {field: value for field, value in counts.items() if value}
+    if not counts:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for field, value in counts.items():
+            if isinstance(value, float):
+                pipe.hincrbyfloat(_stats_key(name), field, value)
+            else:
+                pipe.hincrby(_stats_key(name), field, value)
+        pipe.execute()
+        return True
+    except Exception as e:
+        print(f"Error updating {name} stats: {str(e)}")
+        return False
+
+def get_stats(name, defaults):
+    """Shared counters typed like defaults; fields never incremented get the default."""
+    data = redis_client.hgetall(_stats_key(name))
+    return {field: type(default)(data.get(field, default)) for field, default in defaults.items()}
+
+# кэш популярных поисковых запросов
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 60))
+# кэшируем запрос, только если его повторили за время SEARCH_CACHE_TTL
+SEARCH_CACHE_MIN_HITS = int(os.getenv('SEARCH_CACHE_MIN_HITS', 2))
+
+def _search_key(query, limit, offset):
+    digest = hashlib.sha256(f"{query}|{limit}|{offset}".encode()).hexdigest()
+    return f"search:{digest}"
+
+def get_cached_search(query, limit, offset):
+    """Cached (body, count) or None, plus the hit count that decides whether to cache."""
+    try:
+        key = _search_key(query, limit, offset)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.get(f"{key}:count")
+        pipe.incr(f"{key}:hits")
+        pipe.expire(f"{key}:hits", SEARCH_CACHE_TTL)
+        body, count, hits, _ = pipe.execute()
+        if body is not None and count is not None:
+            # готовый JSON отдается без разбора, число результатов лежит рядом
+            return (body, int(count)), hits
+        return None, hits
+    except Exception as e:
+        print(f"Error getting cached search: {str(e)}")
+        return None, 0
+
+def cache_search(query, limit, offset, body, count):
     try:
-        redis_client.publish(channel, json.dumps(message))
+        key = _search_key(query, limit, offset)
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.setex(key, SEARCH_CACHE_TTL, body)
+        pipe.setex(f"{key}:count", SEARCH_CACHE_TTL, count)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error caching search: {str(e)}")
+
+# Уведомления: поток (Streams) для групп потребителей + PubSub для старых подписчиков
+NOTIFICATION_CHANNELS = ('artworks', 'artwork_reviews', 'orders')
+NOTIFICATION_STREAM_MAXLEN = int(os.getenv('NOTIFICATION_STREAM_MAXLEN', 100000))
+
+def notification_stream_key(channel):
+    return f"stream:{channel}"
+
+def publish_notifications(events):
+    """Publish a batch of (channel, message) pairs in one pipeline round trip."""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for channel, message in events:
+            data = json.dumps(message)
+            # событие остается в потоке, даже если сейчас никто не слушает
+            pipe.xadd(notification_stream_key(channel), {'data': data}, maxlen=NOTIFICATION_STREAM_MAXLEN, approximate=True)
+            pipe.publish(channel, data)
+        pipe.execute()
         return True
     except Exception as e:
-        print(f"Error publishing notification: {str(e)}")
+        print(f"Error publishing notifications: {str(e)}")
         raise
 
+def publish_notification(channel, message):
+    return publish_notifications([(channel, message)])
+
+def ensure_consumer_group(group, channels=NOTIFICATION_CHANNELS):
+    # группа получает события, опубликованные после ее создания
+    for channel in channels:
+        try:
+            redis_client.xgroup_create(notification_stream_key(channel), group, id='$', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+def get_notification_lag(channels=NOTIFICATION_CHANNELS):
+    """Per stream and group: entries not yet delivered (lag) and delivered but not acked (pending)."""
+    stats = {}
+    for channel in channels:
+        key = notification_stream_key(channel)
+        try:
+            groups = redis_client.xinfo_groups(key)
+            length = redis_client.xlen(key)
+        except redis.exceptions.ResponseError:
+            # потока еще нет
+            continue
+        stats[channel] = {
+            'length': length,
+            'groups': {
+                group['name']: {
+                    'consumers': group['consumers'],
+                    'pending': group['pending'],
+                    'lag': group.get('lag'),
+                    'last_delivered_id': group['last-delivered-id']
+                }
+                for group in groups
+            }
+        }
+    return stats
+
 def get_pubsub():
     # получаем объект PubSub
     try:
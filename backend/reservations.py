@@ -0,0 +1,140 @@
+import os
+import time
+import random
+import threading
+from psycopg2 import errors
+from db_config import db_connection
+from redis_config import increment_stats, get_stats
+
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', 600))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 5))
+# при горячем товаре ждем блокировку недолго и повторяем, а не висим в очереди
+RESERVATION_LOCK_TIMEOUT = os.getenv('RESERVATION_LOCK_TIMEOUT', '200ms')
+RESERVATION_MAX_RETRIES = int(os.getenv('RESERVATION_MAX_RETRIES', 5))
+
+RETRYABLE_ERRORS = (errors.LockNotAvailable, errors.DeadlockDetected, errors.SerializationFailure)
+
+
+class OutOfStockError(Exception):
+    pass
+
+
+# счетчики лежат в Redis: /admin/reservations/stats видит сумму по всем воркерам
+STATS_DEFAULTS = {
+    'attempts': 0,
+    'succeeded': 0,
+    'out_of_stock': 0,
+    'conflicts': 0,
+    'retries': 0,
+    'gave_up': 0,
+    'lock_wait_time_total': 0.0,
+    'released': 0,
+    'expired_released': 0,
+    'sweeps': 0
+}
+
+
+def _count(counts, name, value=1):
+    counts[name] = counts.get(name, 0) + value
+
+
+def get_reservation_stats():
+    return get_stats('reservations', STATS_DEFAULTS)
+
+
+def _run_with_retry(sql, params):
+    """Run one CALL in its own transaction, retrying lock conflicts with jittered backoff."""
+    # счетчики копим локально и отправляем в Redis одним запросом в конце
+    counts = {}
+    try:
+        for attempt in range(RESERVATION_MAX_RETRIES + 1):
+            _count(counts, 'attempts')
+            start = time.perf_counter()
+            with db_connection() as conn:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SET LOCAL lock_timeout = %s;", (RESERVATION_LOCK_TIMEOUT,))
+                    cur.execute(sql, params)
+                    result = cur.fetchone()
+                    conn.commit()
+                    _count(counts, 'succeeded')
+                    return result
+                except errors.RaiseException as e:
+                    conn.rollback()
+                    _count(counts, 'out_of_stock')
+                    raise OutOfStockError(e.diag.message_primary)
+                except RETRYABLE_ERRORS:
+                    conn.rollback()
+                    _count(counts, 'conflicts')
+                    _count(counts, 'lock_wait_time_total', time.perf_counter() - start)
+                    if attempt == RESERVATION_MAX_RETRIES:
+                        _count(counts, 'gave_up')
+                        raise
+                finally:
+                    cur.close()
+            _count(counts, 'retries')
+            time.sleep(random.uniform(0, 0.01 * (2 ** attempt)))
+    finally:
+        increment_stats('reservations', counts)
+
+
+def reserve_stock(user_id, artwork_id, quantity, ttl=RESERVATION_TTL):
+    """Hold stock for a cart. Returns (reservation_id, remaining_stock)."""
+    return _run_with_retry(
+        "CALL reserve_stock_proc(%s, %s, %s, %s, NULL, NULL);",
+        (user_id, artwork_id, quantity, ttl)
+    )
+
+
+def release_reservation(reservation_id, user_id):
+    """Return held stock. Returns artwork_id or None if nothing was active."""
+    artwork_id = _run_with_retry(
+        "CALL release_reservation_proc(%s, %s, NULL);",
+        (reservation_id, user_id)
+    )[0]
+    if artwork_id is not None:
+        increment_stats('reservations', {'released': 1})
+    return artwork_id
+
+
+def checkout_reservations(user_id, reservation_ids):
+    """Turn active reservations into one order. Returns order_id."""
+    return _run_with_retry(
+        "CALL checkout_reservations_proc(%s, %s, NULL);",
+        (user_id, list(reservation_ids))
+    )[0]
+
+
+def release_expired_reservations(batch_size=500):
+    """Release one batch of expired holds. Returns list of (artwork_id, quantity)."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM release_expired_reservations_proc(%s);", (batch_size,))
+        released = cur.fetchall()
+        conn.commit()
+        cur.close()
+    increment_stats('reservations', {'sweeps': 1, 'expired_released': len(released)})
+    return released
+
+
+def _sweep_forever(interval, on_released):
+    while True:
+        try:
+            released = release_expired_reservations()
+            if released and on_released:
+                on_released([artwork_id for artwork_id, _ in released])
+        except Exception as e:
+            print(f"Error releasing expired reservations: {str(e)}")
+        time.sleep(interval)
+
+
+def start_reservation_sweeper(interval=RESERVATION_SWEEP_INTERVAL, on_released=None):
+    thread = threading.Thread(target=_sweep_forever, args=(interval, on_released), daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    # отдельный процесс-чистильщик
+    print("Releasing expired reservations...")
+    _sweep_forever(RESERVATION_SWEEP_INTERVAL, None)
@@ -1,4 +1,7 @@
 
+-- Триграммы для поиска с опечатками
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Таблица ролей
 CREATE TABLE IF NOT EXISTS role (
     id SERIAL PRIMARY KEY,
@@ -28,7 +31,16 @@ CREATE TABLE IF NOT EXISTS artwork (
     price NUMERIC(10, 2) NOT NULL CHECK (price >= 0),
     category_id INTEGER REFERENCES category(id) NOT NULL,
     photo_url VARCHAR(255),
-    last_review_date TIMESTAMP
+    last_review_date TIMESTAMP,
+    -- агрегаты отзывов, поддерживаются триггером trg_update_last_review_date
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_avg NUMERIC(3, 2) NOT NULL DEFAULT 0,
+    -- полнотекстовый поиск: название важнее описания
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED
 );
 
 -- Таблица инвентаризации
@@ -55,6 +67,27 @@ CREATE TABLE IF NOT EXISTS orderitem (
     price NUMERIC(10, 2) NOT NULL CHECK (price >= 0)
 );
 
+-- Таблица резервов товара (корзина удерживает остаток до expires_at)
+CREATE TABLE IF NOT EXISTS reservation (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES "user"(id) NOT NULL,
+    artwork_id INTEGER REFERENCES artwork(id) NOT NULL,
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    status VARCHAR(20) NOT NULL DEFAULT 'active',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_reservation_active_expires ON reservation(expires_at) WHERE status = 'active';
+
+-- Таблица исходящих уведомлений (transactional outbox): событие пишется в той же транзакции, что и данные
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    channel VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Таблица отзывов
 CREATE TABLE IF NOT EXISTS reviews (
     id SERIAL PRIMARY KEY,
@@ -65,20 +98,59 @@ CREATE TABLE IF NOT EXISTS reviews (
     review_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Создание функции триггера для обновления last_review_date
+-- Индексы для постраничного каталога
+CREATE INDEX IF NOT EXISTS idx_artwork_category_id ON artwork(category_id, id);
+CREATE INDEX IF NOT EXISTS idx_artwork_price ON artwork(price);
+CREATE INDEX IF NOT EXISTS idx_artwork_rating ON artwork(rating_avg DESC, id DESC);
+
+-- Индексы для поиска
+CREATE INDEX IF NOT EXISTS idx_artwork_search ON artwork USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_artwork_title_trgm ON artwork USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_reviews_artwork_date ON reviews(artwork_id, review_date DESC, id DESC);
+
+-- Индексы для истории заказов
+CREATE INDEX IF NOT EXISTS idx_order_user_date ON "order"(user_id, order_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_order_date ON "order"(order_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orderitem_order_id ON orderitem(order_id);
+
+-- Создание функции триггера для обновления last_review_date и агрегатов рейтинга
 CREATE OR REPLACE FUNCTION update_last_review_date()
 RETURNS TRIGGER AS $$
 BEGIN
-    UPDATE artwork
-    SET last_review_date = NEW.review_date
-    WHERE id = NEW.artwork_id;
-    RETURN NEW;
+    -- массовая загрузка пересчитывает агрегаты одним запросом в конце своей транзакции
+    -- (SET LOCAL app.skip_review_aggregates = 'on'); так не нужен ALTER TABLE ... DISABLE TRIGGER
+    IF current_setting('app.skip_review_aggregates', true) = 'on' THEN
+        RETURN COALESCE(NEW, OLD);
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE artwork
+        SET rating_sum = rating_sum - OLD.rating,
+            rating_count = rating_count - 1,
+            rating_avg = CASE WHEN rating_count - 1 > 0
+                              THEN round((rating_sum - OLD.rating)::NUMERIC / (rating_count - 1), 2)
+                              ELSE 0 END,
+            last_review_date = (SELECT max(r.review_date) FROM reviews r WHERE r.artwork_id = OLD.artwork_id)
+        WHERE id = OLD.artwork_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE artwork
+        SET rating_sum = rating_sum + NEW.rating,
+            rating_count = rating_count + 1,
+            rating_avg = round((rating_sum + NEW.rating)::NUMERIC / (rating_count + 1), 2),
+            last_review_date = GREATEST(last_review_date, NEW.review_date)
+        WHERE id = NEW.artwork_id;
+        RETURN NEW;
+    END IF;
+
+    RETURN OLD;
 END;
 $$ LANGUAGE plpgsql;
 
 -- Создание триггера
 CREATE TRIGGER trg_update_last_review_date
-AFTER INSERT ON reviews
+AFTER INSERT OR DELETE OR UPDATE OF rating, artwork_id ON reviews
 FOR EACH ROW
 EXECUTE FUNCTION update_last_review_date();
 
@@ -129,8 +201,12 @@ CREATE OR REPLACE PROCEDURE create_order_proc(
 LANGUAGE plpgsql
 AS $$
 BEGIN
-    -- Проверка наличия товара
-    IF (SELECT stock FROM inventory WHERE artwork_id = p_artwork_id) < p_quantity THEN
+    -- Списание и проверка одним условным UPDATE (без гонки check-then-act)
+    UPDATE inventory
+    SET stock = stock - p_quantity
+    WHERE artwork_id = p_artwork_id AND stock >= p_quantity;
+
+    IF NOT FOUND THEN
         RAISE EXCEPTION 'Недостаточно товара на складе';
     END IF;
 
@@ -144,11 +220,216 @@ BEGIN
     SELECT p_order_id, a.id, p_quantity, a.price
     FROM artwork a
     WHERE a.id = p_artwork_id;
+END;
+$$;
+
+--  процедура для оформления всей корзины одним заказом
+CREATE OR REPLACE PROCEDURE create_order_items_proc(
+    p_user_id INTEGER,
+    p_artwork_ids INTEGER[],
+    p_quantities INTEGER[],
+    OUT p_order_id INTEGER
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_items_count INTEGER;
+    v_locked_count INTEGER;
+    v_updated_count INTEGER;
+    v_short_artwork_id INTEGER;
+BEGIN
+    IF array_length(p_artwork_ids, 1) IS NULL
+       OR array_length(p_artwork_ids, 1) <> array_length(p_quantities, 1) THEN
+        RAISE EXCEPTION 'Некорректный состав заказа';
+    END IF;
+
+    SELECT count(DISTINCT x) INTO v_items_count FROM unnest(p_artwork_ids) AS x;
+
+    -- Блокируем строки инвентаря всегда в порядке artwork_id, чтобы не было дедлоков
+    SELECT count(*) INTO v_locked_count
+    FROM (
+        SELECT i.artwork_id
+        FROM inventory i
+        WHERE i.artwork_id = ANY(p_artwork_ids)
+        ORDER BY i.artwork_id
+        FOR UPDATE
+    ) locked;
+
+    IF v_locked_count <> v_items_count THEN
+        RAISE EXCEPTION 'Произведение не найдено';
+    END IF;
+
+    -- Условное списание (одинаковые позиции складываем)
+    UPDATE inventory i
+    SET stock = i.stock - items.quantity
+    FROM (
+        SELECT t.artwork_id, sum(t.quantity) AS quantity
+        FROM unnest(p_artwork_ids, p_quantities) AS t(artwork_id, quantity)
+        GROUP BY t.artwork_id
+    ) items
+    WHERE i.artwork_id = items.artwork_id AND i.stock >= items.quantity;
+
+    GET DIAGNOSTICS v_updated_count = ROW_COUNT;
+    IF v_updated_count <> v_items_count THEN
+        SELECT i.artwork_id INTO v_short_artwork_id
+        FROM (
+            SELECT t.artwork_id, sum(t.quantity) AS quantity
+            FROM unnest(p_artwork_ids, p_quantities) AS t(artwork_id, quantity)
+            GROUP BY t.artwork_id
+        ) items
+        JOIN inventory i ON i.artwork_id = items.artwork_id
+        WHERE i.stock < items.quantity
+        ORDER BY i.artwork_id
+        LIMIT 1;
+        -- исключение откатывает уже выполненные списания
+        RAISE EXCEPTION 'Недостаточно товара на складе (artwork_id=%)', v_short_artwork_id;
+    END IF;
 
-    -- Обновление инвентаря
+    -- Создание заказа
+    INSERT INTO "order" (user_id, status)
+    VALUES (p_user_id, 'pending')
+    RETURNING id INTO p_order_id;
+
+    -- Добавление элементов заказа
+    INSERT INTO orderitem (order_id, artwork_id, quantity, price)
+    SELECT p_order_id, a.id, items.quantity, a.price
+    FROM (
+        SELECT t.artwork_id, sum(t.quantity) AS quantity
+        FROM unnest(p_artwork_ids, p_quantities) AS t(artwork_id, quantity)
+        GROUP BY t.artwork_id
+    ) items
+    JOIN artwork a ON a.id = items.artwork_id
+    ORDER BY a.id;
+END;
+$$;
+
+--  процедура резервирования товара (остаток списывается сразу и возвращается при отмене/истечении)
+CREATE OR REPLACE PROCEDURE reserve_stock_proc(
+    p_user_id INTEGER,
+    p_artwork_id INTEGER,
+    p_quantity INTEGER,
+    p_ttl_seconds INTEGER,
+    OUT p_reservation_id INTEGER,
+    OUT p_stock INTEGER
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
     UPDATE inventory
     SET stock = stock - p_quantity
-    WHERE artwork_id = p_artwork_id;
+    WHERE artwork_id = p_artwork_id AND stock >= p_quantity
+    RETURNING stock INTO p_stock;
+
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Недостаточно товара на складе (artwork_id=%)', p_artwork_id;
+    END IF;
+
+    INSERT INTO reservation (user_id, artwork_id, quantity, expires_at)
+    VALUES (p_user_id, p_artwork_id, p_quantity, CURRENT_TIMESTAMP + make_interval(secs => p_ttl_seconds))
+    RETURNING id INTO p_reservation_id;
+END;
+$$;
+
+--  процедура отмены резерва
+CREATE OR REPLACE PROCEDURE release_reservation_proc(
+    p_reservation_id INTEGER,
+    p_user_id INTEGER,
+    OUT p_artwork_id INTEGER
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_quantity INTEGER;
+BEGIN
+    UPDATE reservation
+    SET status = 'released'
+    WHERE id = p_reservation_id AND user_id = p_user_id AND status = 'active'
+    RETURNING artwork_id, quantity INTO p_artwork_id, v_quantity;
+
+    IF FOUND THEN
+        UPDATE inventory
+        SET stock = stock + v_quantity
+        WHERE artwork_id = p_artwork_id;
+    END IF;
+END;
+$$;
+
+--  процедура возврата просроченных резервов (несколько чистильщиков не мешают друг другу)
+CREATE OR REPLACE FUNCTION release_expired_reservations_proc(p_batch_size INTEGER DEFAULT 500)
+RETURNS TABLE(artwork_id INTEGER, quantity BIGINT) AS $$
+BEGIN
+    RETURN QUERY
+    WITH expired AS (
+        SELECT r.id
+        FROM reservation r
+        WHERE r.status = 'active' AND r.expires_at < CURRENT_TIMESTAMP
+        ORDER BY r.id
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ), released AS (
+        UPDATE reservation r
+        SET status = 'expired'
+        FROM expired e
+        WHERE r.id = e.id
+        RETURNING r.artwork_id, r.quantity
+    ), totals AS (
+        SELECT rl.artwork_id, sum(rl.quantity) AS quantity
+        FROM released rl
+        GROUP BY rl.artwork_id
+    ), restocked AS (
+        UPDATE inventory i
+        SET stock = i.stock + t.quantity
+        FROM totals t
+        WHERE i.artwork_id = t.artwork_id
+        RETURNING i.artwork_id
+    )
+    SELECT t.artwork_id, t.quantity FROM totals t;
+END;
+$$ LANGUAGE plpgsql;
+
+--  процедура оформления заказа из резервов пользователя
+CREATE OR REPLACE PROCEDURE checkout_reservations_proc(
+    p_user_id INTEGER,
+    p_reservation_ids INTEGER[],
+    OUT p_order_id INTEGER
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_locked_count INTEGER;
+BEGIN
+    SELECT count(*) INTO v_locked_count
+    FROM (
+        SELECT r.id
+        FROM reservation r
+        WHERE r.id = ANY(p_reservation_ids)
+          AND r.user_id = p_user_id
+          AND r.status = 'active'
+          AND r.expires_at >= CURRENT_TIMESTAMP
+        ORDER BY r.id
+        FOR UPDATE
+    ) locked;
+
+    IF v_locked_count = 0 OR v_locked_count <> (SELECT count(DISTINCT x) FROM unnest(p_reservation_ids) AS x) THEN
+        RAISE EXCEPTION 'Резерв не найден или истек';
+    END IF;
+
+    INSERT INTO "order" (user_id, status)
+    VALUES (p_user_id, 'pending')
+    RETURNING id INTO p_order_id;
+
+    -- остаток уже списан при резервировании
+    INSERT INTO orderitem (order_id, artwork_id, quantity, price)
+    SELECT p_order_id, a.id, sum(r.quantity), a.price
+    FROM reservation r
+    JOIN artwork a ON a.id = r.artwork_id
+    WHERE r.id = ANY(p_reservation_ids)
+    GROUP BY a.id, a.price
+    ORDER BY a.id;
+
+    UPDATE reservation
+    SET status = 'completed'
+    WHERE id = ANY(p_reservation_ids);
 END;
 $$;
 
@@ -177,12 +458,15 @@ RETURNS TABLE(
     category VARCHAR,
     stock INTEGER,
     photo_url VARCHAR,
-    last_review_date TIMESTAMP
+    last_review_date TIMESTAMP,
+    rating_avg NUMERIC,
+    rating_count INTEGER
 ) AS $$
 BEGIN
     RETURN QUERY
     SELECT 
-        a.id, a.title, a.description, a.price, c.name, i.stock, a.photo_url, a.last_review_date
+        a.id, a.title, a.description, a.price, c.name, i.stock, a.photo_url, a.last_review_date,
+        a.rating_avg, a.rating_count
     FROM 
         artwork a
     JOIN 
@@ -192,6 +476,118 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+--  постраничный каталог с фильтрами (keyset по id или по (rating_avg, id))
+CREATE OR REPLACE FUNCTION get_artworks_page_proc(
+    p_after_id INTEGER DEFAULT NULL,
+    p_limit INTEGER DEFAULT 20,
+    p_category VARCHAR DEFAULT NULL,
+    p_min_price NUMERIC DEFAULT NULL,
+    p_max_price NUMERIC DEFAULT NULL,
+    p_in_stock_only BOOLEAN DEFAULT FALSE,
+    p_sort VARCHAR DEFAULT 'id',
+    p_after_rating NUMERIC DEFAULT NULL
+)
+RETURNS TABLE(
+    id INTEGER,
+    title VARCHAR,
+    description TEXT,
+    price NUMERIC,
+    category VARCHAR,
+    stock INTEGER,
+    photo_url VARCHAR,
+    last_review_date TIMESTAMP,
+    rating_avg NUMERIC,
+    rating_count INTEGER
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        a.id, a.title, a.description, a.price, c.name, i.stock, a.photo_url, a.last_review_date,
+        a.rating_avg, a.rating_count
+    FROM
+        artwork a
+    JOIN
+        category c ON a.category_id = c.id
+    JOIN
+        inventory i ON a.id = i.artwork_id
+    WHERE (p_after_id IS NULL
+           OR (p_sort = 'rating' AND (a.rating_avg, a.id) < (p_after_rating, p_after_id))
+           OR (p_sort <> 'rating' AND a.id > p_after_id))
+      AND (p_category IS NULL OR a.category_id = (SELECT cc.id FROM category cc WHERE cc.name = p_category))
+      AND (p_min_price IS NULL OR a.price >= p_min_price)
+      AND (p_max_price IS NULL OR a.price <= p_max_price)
+      AND (NOT p_in_stock_only OR i.stock > 0)
+    ORDER BY
+        CASE WHEN p_sort = 'rating' THEN a.rating_avg END DESC,
+        CASE WHEN p_sort = 'rating' THEN a.id END DESC,
+        a.id
+    LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Поиск по названию и описанию: полнотекстовые совпадения + названия с опечатками
+CREATE OR REPLACE FUNCTION search_artworks_proc(
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0,
+    p_candidates INTEGER DEFAULT 1000
+)
+RETURNS TABLE(
+    id INTEGER,
+    title VARCHAR,
+    description TEXT,
+    price NUMERIC,
+    category VARCHAR,
+    stock INTEGER,
+    photo_url VARCHAR,
+    last_review_date TIMESTAMP,
+    rating_avg NUMERIC,
+    rating_count INTEGER,
+    search_rank REAL
+) AS $$
+BEGIN
+    RETURN QUERY
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', p_query) AS tsq
+    ), fts_candidates AS (
+        -- не больше p_candidates совпадений прямо из GIN-индекса, без сортировки: LIMIT обрывает скан,
+        -- и для частого слова ранг считается для p_candidates строк, а не для всех совпадений
+        SELECT a.id, a.search_vector
+        FROM artwork a, q
+        WHERE a.search_vector @@ q.tsq
+        LIMIT p_candidates
+    ), fts AS (
+        SELECT f.id AS artwork_id, ts_rank_cd(f.search_vector, q.tsq)::REAL AS score
+        FROM fts_candidates f, q
+    ), fuzzy_candidates AS (
+        -- похожие названия по триграммам: запрос сравнивается с лучшим куском названия
+        -- (порог pg_trgm.word_similarity_threshold), так опечатка находится и в длинном названии;
+        -- <% тоже идет по idx_artwork_title_trgm
+        SELECT a.id, a.title
+        FROM artwork a
+        WHERE p_query <% a.title
+        LIMIT p_candidates
+    ), fuzzy AS (
+        -- ниже точных совпадений
+        SELECT f.id AS artwork_id, (word_similarity(p_query, f.title) / 2)::REAL AS score
+        FROM fuzzy_candidates f
+    ), matches AS (
+        SELECT m.artwork_id, max(m.score) AS score
+        FROM (SELECT * FROM fts UNION ALL SELECT * FROM fuzzy) m
+        GROUP BY m.artwork_id
+    )
+    SELECT
+        a.id, a.title, a.description, a.price, c.name, i.stock, a.photo_url, a.last_review_date,
+        a.rating_avg, a.rating_count, m.score
+    FROM matches m
+    JOIN artwork a ON a.id = m.artwork_id
+    JOIN category c ON a.category_id = c.id
+    JOIN inventory i ON a.id = i.artwork_id
+    ORDER BY m.score DESC, a.id
+    LIMIT p_limit OFFSET p_offset;
+END;
+$$ LANGUAGE plpgsql;
+
 --  процедура для добавления произведения искусства (admin)
 CREATE OR REPLACE PROCEDURE add_artwork_proc(
     p_title VARCHAR,
@@ -244,6 +640,7 @@ LANGUAGE plpgsql
 AS $$
 BEGIN
     DELETE FROM reviews WHERE artwork_id = p_artwork_id;
+    DELETE FROM reservation WHERE artwork_id = p_artwork_id;
     DELETE FROM orderitem WHERE artwork_id = p_artwork_id;
     DELETE FROM inventory WHERE artwork_id = p_artwork_id;
     DELETE FROM artwork WHERE id = p_artwork_id;
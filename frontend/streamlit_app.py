@@ -1,9 +1,20 @@
+import threading
 import streamlit as st
 import requests
-from PIL import Image
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 API_URL = "http://backend:8000"  # docker
+PAGE_SIZE = 10
+REVIEWS_PAGE_SIZE = 20
+REQUEST_TIMEOUT = 10
+# время жизни кэша на стороне Streamlit, секунды
+CATALOG_TTL = 15
+REVIEWS_TTL = 30
+# имена картинок содержат хэш содержимого, их можно держать долго
+IMAGE_TTL = 3600
+IMAGE_FETCH_WORKERS = 8
+ETAG_STORE_SIZE = 256
+PAGE_HEADERS = ('X-Next-Cursor', 'X-Next-Rating', 'X-Next-Date', 'X-Next-Offset')
 
 # Инициализация сессионных переменных
 if 'logged_in' not in st.session_state:
@@ -14,6 +25,89 @@ if 'cart' not in st.session_state:
     st.session_state['cart'] = []
 if 'role' not in st.session_state:
     st.session_state['role'] = 'regular_user'
+if 'catalog_cursors' not in st.session_state:
+    st.session_state['catalog_cursors'] = [None]
+# у своих заказов и у всех заказов (админ) разные курсоры
+if 'orders_cursors' not in st.session_state:
+    st.session_state['orders_cursors'] = [None]
+if 'admin_orders_cursors' not in st.session_state:
+    st.session_state['admin_orders_cursors'] = [None]
+
+@st.cache_resource
+def http():
+    # одна сессия с keep-alive соединениями на весь процесс, а не новое TCP на каждый запрос
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=IMAGE_FETCH_WORKERS * 2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def client_headers():
+    # адрес браузера для лимитов бэкенда (TRUSTED_PROXIES=1), иначе все входы идут с адреса этого контейнера
+    try:
+        ip = st.context.ip_address
+        if not ip:
+            forwarded = st.context.headers.get('X-Forwarded-For', '')
+            ip = forwarded.split(',')[-1].strip()
+    except AttributeError:
+        # старый Streamlit без st.context
+        ip = None
+    return {'X-Forwarded-For': ip} if ip else {}
+
+@st.cache_resource
+def etag_store():
+    # последние ответы по URL: если ETag совпал, сервер отвечает 304 без тела.
+    # Хранилище общее для всех сессий (потоков), поэтому доступ под замком
+    return {}, threading.Lock()
+
+def get_json(path, params=None):
+    """GET with If-None-Match. Returns (data, page headers), raises on HTTP errors."""
+    key = (path, tuple(sorted((params or {}).items())))
+    store, lock = etag_store()
+    with lock:
+        cached = store.get(key)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    response = http().get(f"{API_URL}{path}", params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached:
+        return cached[1], cached[2]
+    response.raise_for_status()
+    data = response.json()
+    page_headers = {name: response.headers[name] for name in PAGE_HEADERS if name in response.headers}
+    etag = response.headers.get('ETag')
+    if etag:
+        with lock:
+            if key not in store and len(store) >= ETAG_STORE_SIZE:
+                store.pop(next(iter(store)))
+            store[key] = (etag, data, page_headers)
+    return data, page_headers
+
+@st.cache_data(ttl=CATALOG_TTL, show_spinner=False)
+def fetch_artworks(path, params):
+    # каталог или результаты поиска
+    return get_json(path, params)
+
+@st.cache_data(ttl=REVIEWS_TTL, show_spinner=False)
+def fetch_reviews(artwork_id, limit):
+    return get_json(f"/reviews/{artwork_id}", {'limit': limit})[0]
+
+def download_image(session, url):
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT)
+        return response.content if response.status_code == 200 else None
+    except requests.exceptions.RequestException:
+        return None
+
+@st.cache_data(ttl=IMAGE_TTL, max_entries=100, show_spinner=False)
+def fetch_images(urls):
+    # картинки страницы качаем параллельно, а не по одной
+    session = http()
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS) as pool:
+        return dict(zip(urls, pool.map(lambda url: download_image(session, url), urls)))
+
+def clear_api_cache():
+    # после своих изменений показываем свежие данные, не дожидаясь TTL
+    fetch_artworks.clear()
+    fetch_reviews.clear()
 
 def login():
     st.title("Авторизация")
@@ -21,7 +115,9 @@ def login():
     password = st.text_input("Пароль", type="password")
     if st.button("Войти"):
         try:
-            response = requests.post(f"{API_URL}/login", json={"username": username, "password": password})
+            response = http().post(
+                f"{API_URL}/login", json={"username": username, "password": password}, headers=client_headers()
+            )
             if response.status_code == 200:
                 data = response.json()
                 st.session_state['logged_in'] = True
@@ -46,11 +142,11 @@ def register():
             st.error("Пароли не совпадают")
             return
         try:
-            response = requests.post(f"{API_URL}/register", json={
+            response = http().post(f"{API_URL}/register", json={
                 "username": username,
                 "email": email,
                 "password": password
-            })
+            }, headers=client_headers())
             if response.status_code == 201:
                 st.success("Регистрация прошла успешно! Теперь вы можете войти.")
             else:
@@ -59,89 +155,159 @@ def register():
         except requests.exceptions.ConnectionError:
             st.error("Не удалось подключиться к серверу. Проверьте настройки Docker.")
 
+def reset_catalog_page():
+    st.session_state['catalog_cursors'] = [None]
+
+def catalog_filters():
+    query = st.text_input("Поиск по названию и описанию", key="search_query", on_change=reset_catalog_page)
+    if query.strip():
+        # у поиска свой порядок (по релевантности), фильтры каталога к нему не применяются
+        return "/search", {'q': query.strip(), 'limit': PAGE_SIZE}
+
+    with st.expander("Фильтры"):
+        category = st.text_input("Категория", key="filter_category", on_change=reset_catalog_page)
+        min_price = st.number_input("Цена от", min_value=0.0, value=0.0, step=100.0, key="filter_min_price", on_change=reset_catalog_page)
+        max_price = st.number_input("Цена до (0 - без ограничения)", min_value=0.0, value=0.0, step=100.0, key="filter_max_price", on_change=reset_catalog_page)
+        in_stock = st.checkbox("Только в наличии", key="filter_in_stock", on_change=reset_catalog_page)
+        by_rating = st.checkbox("Сначала с высоким рейтингом", key="filter_by_rating", on_change=reset_catalog_page)
+
+    params = {'limit': PAGE_SIZE}
+    if by_rating:
+        params['sort'] = 'rating'
+    if category:
+        params['category'] = category
+    if min_price > 0:
+        params['min_price'] = min_price
+    if max_price > 0:
+        params['max_price'] = max_price
+    if in_stock:
+        params['in_stock'] = 1
+    return "/artworks", params
+
+def pagination(state_key, next_cursor):
+    cursors = st.session_state[state_key]
+    col_prev, col_page, col_next = st.columns(3)
+    with col_prev:
+        if len(cursors) > 1 and st.button("← Назад", key=f"{state_key}_prev"):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.write(f"Страница {len(cursors)}")
+    with col_next:
+        if next_cursor and st.button("Вперед →", key=f"{state_key}_next"):
+            cursors.append(next_cursor)
+            st.rerun()
+
+def date_cursor(headers):
+    # курсор (дата, id) для отзывов и заказов
+    if not headers.get('X-Next-Cursor'):
+        return None
+    return {'after_id': headers['X-Next-Cursor'], 'after_date': headers['X-Next-Date']}
+
 def show_artworks():
     st.title("Каталог произведений искусства")
+    path, params = catalog_filters()
+    cursor = st.session_state['catalog_cursors'][-1]
+    if cursor is not None:
+        params.update(cursor)
     try:
-        response = requests.get(f"{API_URL}/artworks")
-        if response.status_code == 200:
-            artworks = response.json()
-            for art in artworks:
-                st.subheader(art['title'])
-                st.write(f"Категория: {art['category']}")
-                st.write(art['description'])
-                st.write(f"Цена: {art['price']} | В наличии: {art['stock']}")
-
-                # Отображение изображения
-                if art['photo_url']:
-                    image_url = f"{API_URL}{art['photo_url']}"
-                    try:
-                        image_response = requests.get(image_url)
-                        if image_response.status_code == 200:
-                            image = Image.open(BytesIO(image_response.content))
-                            st.image(image, use_container_width=True)
-                        else:
-                            st.write("Изображение недоступно")
-                    except Exception:
-                        st.write("Ошибка загрузки изображения")
-
-                # Проверка наличия товара
-                if art['stock'] <= 0:
-                    st.warning("Товара нет в наличии")
-                    continue
-
-                # Определение максимального доступного количества
-                max_quantity = art['stock']
-
-                # Проверка, есть ли уже этот товар в корзине
-                existing_item = next((item for item in st.session_state['cart'] if item['artwork_id'] == art['id']), None)
-                if existing_item:
-                    max_quantity = art['stock'] - existing_item['quantity']
-                    if max_quantity <= 0:
-                        st.warning("Достигнуто максимальное количество в корзине")
-                        continue
-
-                quantity = st.number_input(
-                    f"Количество для '{art['title']}'",
-                    min_value=1,
-                    max_value=max_quantity,
-                    value=1,
-                    step=1,
-                    key=f"quantity_{art['id']}"
-                )
-
-                if st.button(f"Добавить '{art['title']}' в корзину", key=f"add_{art['id']}"):
-                    if existing_item:
-                        existing_item['quantity'] += quantity
-                    else:
-                        st.session_state['cart'].append({
-                            'artwork_id': art['id'],
-                            'quantity': quantity,
-                            'title': art['title'],
-                            'price': art['price']
-                        })
-                    st.success(f"Добавлено {quantity} x '{art['title']}' в корзину!")
-
-                # Отображение отзывов
-                if st.checkbox(f"Показать отзывы для '{art['title']}'", key=f"reviews_{art['id']}"):
-                    try:
-                        reviews_response = requests.get(f"{API_URL}/reviews/{art['id']}")
-                        if reviews_response.status_code == 200:
-                            reviews = reviews_response.json()
-                            if reviews:
-                                for review in reviews:
-                                    st.write(f"**{review['username']}** ({review['review_date']}):")
-                                    st.write(f"Рейтинг: {review['rating']}/5")
-                                    st.write(f"Комментарий: {review['comment']}\n")
-                            else:
-                                st.write("Нет отзывов.")
-                        else:
-                            st.error("Не удалось получить отзывы.")
-                    except requests.exceptions.ConnectionError:
-                        st.error("Не удалось подключиться к серверу. Проверьте настройки Docker.")
-        else:
-            st.error("Не удалось получить список произведений")
+        artworks, page_headers = fetch_artworks(path, params)
+    except requests.exceptions.HTTPError:
+        st.error("Не удалось получить список произведений")
+        return
     except requests.exceptions.ConnectionError:
         st.error("Не удалось подключиться к серверу. Проверьте настройки Docker.")
+        return
+
+    if not artworks:
+        st.write("Ничего не найдено.")
+
+    # ширины колонки хватает среднего размера; вся страница картинок грузится параллельно
+    image_urls = {
+        art['id']: f"{API_URL}{(art.get('photo_urls') or {}).get('medium', art['photo_url'])}"
+        for art in artworks if art['photo_url']
+    }
+    images = fetch_images(tuple(image_urls.values()))
+
+    for art in artworks:
+        st.subheader(art['title'])
+        st.write(f"Категория: {art['category']}")
+        st.write(art['description'])
+        st.write(f"Цена: {art['price']} | В наличии: {art['stock']}")
+        if art.get('rating_count'):
+            st.write(f"Рейтинг: {art['rating_avg']:.2f}/5 ({art['rating_count']} отзывов)")
+        else:
+            st.write("Отзывов пока нет")
+
+        # Отображение изображения
+        if art['id'] in image_urls:
+            image = images.get(image_urls[art['id']])
+            if image:
+                st.image(image, use_container_width=True)
+            else:
+                st.write("Изображение недоступно")
+
+        # Проверка наличия товара
+        if art['stock'] <= 0:
+            st.warning("Товара нет в наличии")
+            continue
+
+        # Определение максимального доступного количества
+        max_quantity = art['stock']
+
+        # Проверка, есть ли уже этот товар в корзине
+        existing_item = next((item for item in st.session_state['cart'] if item['artwork_id'] == art['id']), None)
+        if existing_item:
+            max_quantity = art['stock'] - existing_item['quantity']
+            if max_quantity <= 0:
+                st.warning("Достигнуто максимальное количество в корзине")
+                continue
+
+        quantity = st.number_input(
+            f"Количество для '{art['title']}'",
+            min_value=1,
+            max_value=max_quantity,
+            value=1,
+            step=1,
+            key=f"quantity_{art['id']}"
+        )
+
+        if st.button(f"Добавить '{art['title']}' в корзину", key=f"add_{art['id']}"):
+            if existing_item:
+                existing_item['quantity'] += quantity
+            else:
+                st.session_state['cart'].append({
+                    'artwork_id': art['id'],
+                    'quantity': quantity,
+                    'title': art['title'],
+                    'price': art['price']
+                })
+            st.success(f"Добавлено {quantity} x '{art['title']}' в корзину!")
+
+        # Отображение отзывов
+        if st.checkbox(f"Показать отзывы для '{art['title']}'", key=f"reviews_{art['id']}"):
+            try:
+                reviews = fetch_reviews(art['id'], REVIEWS_PAGE_SIZE)
+                if reviews:
+                    for review in reviews:
+                        st.write(f"**{review['username']}** ({review['review_date']}):")
+                        st.write(f"Рейтинг: {review['rating']}/5")
+                        st.write(f"Комментарий: {review['comment']}\n")
+                else:
+                    st.write("Нет отзывов.")
+            except requests.exceptions.HTTPError:
+                st.error("Не удалось получить отзывы.")
+            except requests.exceptions.ConnectionError:
+                st.error("Не удалось подключиться к серверу. Проверьте настройки Docker.")
+
+    next_cursor = None
+    if page_headers.get('X-Next-Offset'):
+        next_cursor = {'offset': page_headers['X-Next-Offset']}
+    elif page_headers.get('X-Next-Cursor'):
+        next_cursor = {'after_id': page_headers['X-Next-Cursor']}
+        if page_headers.get('X-Next-Rating'):
+            next_cursor['after_rating'] = page_headers['X-Next-Rating']
+    pagination('catalog_cursors', next_cursor)
 
 def show_cart():
     st.title("Корзина")
@@ -157,14 +323,15 @@ def show_cart():
 
     if st.button("Оформить заказ"):
         try:
-            response = requests.post(f"{API_URL}/create_order", json={
+            response = http().post(f"{API_URL}/create_order", json={
                 "user_id": st.session_state['user_id'],
                 "items": [{"artwork_id": i['artwork_id'], "quantity": i['quantity']} for i in st.session_state['cart']]
             })
             if response.status_code == 201:
                 data = response.json()
-                st.success(f"Заказы с номерами {data['order_ids']} успешно созданы!")
+                st.success(f"Заказ #{data['order_id']} успешно создан!")
                 st.session_state['cart'].clear()
+                clear_api_cache()
             else:
                 error = response.json().get('error', 'Произошла ошибка')
                 st.error(f"Ошибка при создании заказа: {error}")
@@ -178,13 +345,14 @@ def add_review():
     comment = st.text_area("Комментарий")
     if st.button("Отправить отзыв"):
         try:
-            response = requests.post(f"{API_URL}/add_review", json={
+            response = http().post(f"{API_URL}/add_review", json={
                 "user_id": st.session_state['user_id'],
                 "artwork_id": artwork_id,
                 "rating": rating,
                 "comment": comment
             })
             if response.status_code == 201:
+                clear_api_cache()
                 st.success("Отзыв добавлен!")
             else:
                 error = response.json().get('error', 'Произошла ошибка')
@@ -224,8 +392,9 @@ def admin_panel():
                     'category': category,
                     'stock': stock
                 }
-                response = requests.post(f"{API_URL}/add_artwork", data=data, files=files)
+                response = http().post(f"{API_URL}/add_artwork", data=data, files=files)
                 if response.status_code == 201:
+                    clear_api_cache()
                     st.success("Произведение добавлено успешно!")
                 else:
                     error = response.json().get('error', 'Произошла ошибка')
@@ -238,11 +407,12 @@ def admin_panel():
         artwork_id = st.number_input("ID произведения", min_value=1, value=1)
         if st.button("Удалить произведение"):
             try:
-                response = requests.delete(f"{API_URL}/delete_artwork", json={
+                response = http().delete(f"{API_URL}/delete_artwork", json={
                     "user_id": st.session_state['user_id'],
                     "artwork_id": artwork_id
                 })
                 if response.status_code == 200:
+                    clear_api_cache()
                     st.success("Произведение удалено успешно!")
                 else:
                     error = response.json().get('error', 'Произошла ошибка')
@@ -250,10 +420,17 @@ def admin_panel():
             except requests.exceptions.ConnectionError:
                 st.error("Не удалось подключиться к серверу. Проверьте настройки Docker.")
 
+def orders_params(state_key):
+    params = {'limit': PAGE_SIZE}
+    cursor = st.session_state[state_key][-1]
+    if cursor is not None:
+        params.update(cursor)
+    return params
+
 def show_orders():
     st.title("Мои Заказы")
     try:
-        response = requests.get(f"{API_URL}/orders/{st.session_state['user_id']}")
+        response = http().get(f"{API_URL}/orders/{st.session_state['user_id']}", params=orders_params('orders_cursors'))
         if response.status_code == 200:
             orders = response.json()
             if not orders:
@@ -266,6 +443,7 @@ def show_orders():
                 st.write("Товары:")
                 for item in order['items']:
                     st.write(f"- {item['title']} x {item['quantity']} = {item['quantity'] * item['price']} руб.")
+            pagination('orders_cursors', date_cursor(response.headers))
         else:
             st.error("Не удалось получить заказы.")
     except requests.exceptions.ConnectionError:
@@ -274,7 +452,7 @@ def show_orders():
 def admin_show_all_orders():
     st.title("Все Заказы")
     try:
-        response = requests.get(f"{API_URL}/admin/orders")
+        response = http().get(f"{API_URL}/admin/orders", params=orders_params('admin_orders_cursors'))
         if response.status_code == 200:
             orders = response.json()
             if not orders:
@@ -286,6 +464,7 @@ def admin_show_all_orders():
                 st.write("Товары:")
                 for item in order['items']:
                     st.write(f"- {item['title']} x {item['quantity']} = {item['quantity'] * item['price']} руб.")
+            pagination('admin_orders_cursors', date_cursor(response.headers))
         else:
             st.error("Не удалось получить все заказы.")
     except requests.exceptions.ConnectionError: